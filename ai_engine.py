@@ -1,32 +1,58 @@
 import os
+import json
 import random
+import threading
+import uuid
 from datetime import datetime, timedelta
-from openai import OpenAI
-from anthropic import Anthropic
-import requests
-from PIL import Image
-from io import BytesIO
-
-# Initialize AI clients (with fallback if no API keys)
-try:
-    openai_api_key = os.getenv('OPENAI_API_KEY')
-    anthropic_api_key = os.getenv('ANTHROPIC_API_KEY')
-    
-    if openai_api_key:
-        openai_client = OpenAI(api_key=openai_api_key)
-    else:
-        openai_client = None
-        print("⚠️ Warning: OPENAI_API_KEY not set. AI story generation will be disabled.")
-    
-    if anthropic_api_key:
-        anthropic_client = Anthropic(api_key=anthropic_api_key)
-    else:
-        anthropic_client = None
-        print("⚠️ Warning: ANTHROPIC_API_KEY not set. Claude AI will be disabled.")
-except Exception as e:
-    print(f"⚠️ Warning: Failed to initialize AI clients: {e}")
-    openai_client = None
-    anthropic_client = None
+from evidence_storage import audio_file
+from keyword_matcher import KeywordMatcher
+
+# 回复过滤用的词表（导入时构建一次）：开头出现即视为"思考过程"、整句丢弃的元分析词、保留句子的第一人称情感词
+THINKING_INDICATORS = KeywordMatcher([
+    '我需要', '首先', '其次', '然后', '接着', '分析', '考虑',
+    '回顾', '根据', '基于', '理解', '判断', '推测',
+    '作为楼主，我会', '我应该', '我的回复', '标题是', '情况：'
+])
+META_SENTENCE_WORDS = KeywordMatcher(['首先', '其次', '然后', '接着', '分析', '回顾', '根据', '标题是', '情况：', '我需要', '作为楼主，我'])
+REPLY_SENTENCE_WORDS = KeywordMatcher(['我', '真的', '现在', '昨天', '今天', '刚才', '确实', '感觉', '觉得', '怕', '担心', '不敢', '试试', '怎么办'])
+
+# AI clients are built on first use: importing the SDKs alone takes over a second,
+# and seed.py / the maintenance CLIs never call a provider
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_client(name, env_var, factory, missing_warning):
+    with _clients_lock:
+        if name not in _clients:
+            api_key = os.getenv(env_var)
+            client = None
+            if not api_key:
+                print(missing_warning)
+            else:
+                try:
+                    client = factory(api_key)
+                except Exception as e:
+                    print(f"⚠️ Warning: Failed to initialize AI clients: {e}")
+            _clients[name] = client
+        return _clients[name]
+
+def _openai_factory(api_key):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+def _anthropic_factory(api_key):
+    from anthropic import Anthropic
+    return Anthropic(api_key=api_key)
+
+def get_openai_client():
+    """OpenAI client, or None without OPENAI_API_KEY"""
+    return _get_client('openai', 'OPENAI_API_KEY', _openai_factory,
+                       "⚠️ Warning: OPENAI_API_KEY not set. AI story generation will be disabled.")
+
+def get_anthropic_client():
+    """Anthropic client, or None without ANTHROPIC_API_KEY"""
+    return _get_client('anthropic', 'ANTHROPIC_API_KEY', _anthropic_factory,
+                       "⚠️ Warning: ANTHROPIC_API_KEY not set. Claude AI will be disabled.")
 
 # Horror story personas for AI
 AI_PERSONAS = [
@@ -257,6 +283,8 @@ def generate_ai_story_with_meta():
 def generate_ai_story_content(model, system_role, user_prompt):
     """Helper function to generate story content"""
     try:
+        openai_client = get_openai_client()
+        anthropic_client = get_anthropic_client()
         if not openai_client and not anthropic_client:
             # Return a mock story if no API keys available
             return {
@@ -313,38 +341,42 @@ def generate_ai_story_content(model, system_role, user_prompt):
         print(f"Error generating AI story: {e}")
         return None
 
-def generate_evidence_image(story_title, story_content, story_category='urban_legend'):
-    """Generate horror-themed evidence image using local generation"""
-    try:
-        # 导入本地图片生成函数
-        import sys
-        sys.path.append(os.path.dirname(__file__))
-        from generate_placeholder_images import generate_story_evidence_images, create_abstract_image
-        
-        # 生成2-4张相关图片
-        num_images = random.randint(2, 4)
-        generated_files = generate_story_evidence_images(
-            story_title, 
-            story_content, 
-            story_category, 
-            num_images
+def plan_evidence_images(story_title, story_content, story_category='urban_legend', variant=''):
+    """
+    Pick a story's evidence images without rendering them.
+    Returns [{'file_path', 'render_recipe'}]; the recipe (renderer, text, scene, seed) is stored on the
+    Evidence row and the image is rendered on its first request. Deterministic per story, category,
+    variant and renderer version.
+    """
+    from generate_placeholder_images import plan_story_evidence_images, story_evidence_key
+    
+    # 所有随机选择都由故事内容决定，重试时得到同样的文件
+    evidence_key = story_evidence_key(story_title, story_content, story_category, variant)
+    rng = random.Random(evidence_key)
+    
+    # 2-4张相关图片
+    num_images = rng.randint(2, 4)
+    images = [
+        (filename, {'kind': 'found_footage', 'args': [text, scene_type, seed]})
+        for filename, text, scene_type, seed in plan_story_evidence_images(
+            story_title,
+            story_content,
+            story_category,
+            num_images,
+            variant
         )
-        
-        # 随机决定是否添加一张抽象图片
-        if random.random() > 0.6:
-            abstract_filename = f"abstract_{random.randint(1000, 9999)}.jpg"
-            color_scheme = random.choice(['dark', 'blood', 'cold', 'decay'])
-            create_abstract_image(abstract_filename, color_scheme)
-            generated_files.append(abstract_filename)
-        
-        print(f"✅ 为故事生成了 {len(generated_files)} 张证据图片")
-        
-        # 返回文件路径列表
-        return [f"/evidence/{filename}" for filename in generated_files]
-        
-    except Exception as e:
-        print(f"⚠️ 生成证据图片失败: {e}")
-        return []
+    ]
+    
+    # 随机决定是否添加一张抽象图片
+    if rng.random() > 0.6:
+        color_scheme = rng.choice(['dark', 'blood', 'cold', 'decay'])
+        abstract_filename = f"abstract_{evidence_key[:16]}.jpg"
+        images.append((abstract_filename, {'kind': 'abstract', 'args': [color_scheme, abstract_filename]}))
+    
+    return [{
+        'file_path': f"/evidence/{filename}",
+        'render_recipe': json.dumps(recipe, ensure_ascii=False)
+    } for filename, recipe in images]
 
 def generate_evidence_audio(text_content):
     """Generate spooky audio narration using OpenAI TTS"""
@@ -352,18 +384,23 @@ def generate_evidence_audio(text_content):
         # Limit text length for TTS
         narration_text = text_content[:500]
         
-        response = openai_client.audio.speech.create(
+        response = get_openai_client().audio.speech.create(
             model="tts-1",
             voice="onyx",  # Deep, serious voice
             input=narration_text
         )
         
-        # Generate unique filename
+        # Unique filename: /generated/ is cached as immutable, and parallel evidence workers
+        # can finish within the same second
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"audio_{timestamp}.mp3"
-        filepath = f"static/generated/{filename}"
+        filename = f"audio_{timestamp}_{uuid.uuid4().hex}.mp3"
+        filepath = audio_file(filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
         
-        response.stream_to_file(filepath)
+        # Written under a temp name so a half-streamed file is never served
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        response.stream_to_file(tmp_path)
+        os.replace(tmp_path, filepath)
         
         return f"/generated/{filename}"
         
@@ -438,14 +475,8 @@ def generate_ai_response(story, user_comment):
                 print(f"[generate_ai_response] 移除 <think> 后: {ai_reply[:100]}...")
             
             # 强力过滤思考过程
-            # 检测是否包含"思考过程"的关键特征
-            thinking_indicators = [
-                '我需要', '首先', '其次', '然后', '接着', '分析', '考虑',
-                '回顾', '根据', '基于', '理解', '判断', '推测',
-                '作为楼主，我会', '我应该', '我的回复', '标题是', '情况：'
-            ]
-            
-            has_thinking = any(indicator in ai_reply[:100] for indicator in thinking_indicators)
+            # 检测前100字是否包含"思考过程"的关键特征
+            has_thinking = THINKING_INDICATORS.contains_any(ai_reply[:100])
             
             if has_thinking or len(ai_reply) > 150:
                 print(f"[generate_ai_response] ⚠️ 检测到思考过程或回复过长 ({len(ai_reply)}字)，启动强力过滤...")
@@ -489,11 +520,11 @@ def generate_ai_response(story, user_comment):
                         continue
                     
                     # 跳过包含思考过程关键词的句子
-                    if any(word in sent for word in ['首先', '其次', '然后', '接着', '分析', '回顾', '根据', '标题是', '情况：', '我需要', '作为楼主，我']):
+                    if META_SENTENCE_WORDS.contains_any(sent):
                         continue
                     
                     # 保留看起来像实际回复的句子（第一人称情感表达）
-                    if any(word in sent for word in ['我', '真的', '现在', '昨天', '今天', '刚才', '确实', '感觉', '觉得', '怕', '担心', '不敢', '试试', '怎么办']):
+                    if REPLY_SENTENCE_WORDS.contains_any(sent):
                         clean_sentences.append(sent)
                 
                 if clean_sentences:
@@ -569,7 +600,7 @@ def generate_ai_response(story, user_comment):
         model = os.getenv('AI_MODEL', 'gpt-4-turbo-preview')
         
         if 'gpt' in model.lower():
-            response = openai_client.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.8,
@@ -577,7 +608,7 @@ def generate_ai_response(story, user_comment):
             )
             return response.choices[0].message.content
         else:
-            response = anthropic_client.messages.create(
+            response = get_anthropic_client().messages.create(
                 model="claude-3-haiku-20240307",
                 max_tokens=200,
                 messages=[{"role": "user", "content": prompt}]
@@ -597,12 +628,10 @@ def generate_ai_response(story, user_comment):
 
 def should_generate_new_story():
     """Determine if it's time to generate a new story"""
-    from app import Story, db
+    from story_stats import active_story_count
     
-    # Check active stories count
-    active_stories = Story.query.filter(
-        Story.current_state != 'ended'
-    ).count()
+    # Maintained counter instead of a COUNT(*) over all non-ended stories
+    active_stories = active_story_count()
     
     # 提高最大活跃故事数量，支持每5分钟生成新故事
     max_active = int(os.getenv('MAX_ACTIVE_STORIES', 50))
@@ -1,9 +1,8 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Blueprint, Flask, current_app, jsonify, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
-from apscheduler.schedulers.background import BackgroundScheduler
 import jwt
 import os
 import json
@@ -11,16 +10,25 @@ import threading
 import time
 import random
 from dotenv import load_dotenv
+import hmac
+import mimetypes
 
+# Before the project imports: static_cache, evidence_storage and others read settings at import
 load_dotenv()
 
-app = Flask(__name__, static_folder='static', static_url_path='')
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-horror')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///ai_urban_legends.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+import metrics
+import profiling
+import schema_upgrade
+import story_stats
+from generation_controller import AI_REPLY_QUEUE, record_provider_latency
+import static_cache
+from static_cache import send_static, IMMUTABLE
+from evidence_storage import EVIDENCE_ROOT, AUDIO_ROOT, relative_path
 
-CORS(app, resources={r"/api/*": {"origins": "*"}})
-db = SQLAlchemy(app)
+# Bound to an app in create_app, so models can be imported without building one
+db = SQLAlchemy()
+# All routes; registered on the app by create_app
+bp = Blueprint('forum', __name__)
 
 # Database Models
 class User(db.Model):
@@ -40,13 +48,22 @@ class Story(db.Model):
     location = db.Column(db.String(100))
     is_ai_generated = db.Column(db.Boolean, default=False)
     ai_persona = db.Column(db.String(100))
-    current_state = db.Column(db.String(50), default='init')
+    # active_history: the story_stat listeners need the previous state even when it was expired
+    current_state = db.column_property(db.Column(db.String(50), default='init'), active_history=True)
     state_data = db.Column(db.Text)
+    next_transition_at = db.Column(db.DateTime, index=True)
+    # server_default lets schema_upgrade add these NOT NULL columns to existing tables
+    interaction_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    evidence_generated = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # Consecutive failed transition attempts and the last error; the deadline backs off meanwhile
+    transition_failures = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    transition_error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     views = db.Column(db.Integer, default=0)
     comments = db.relationship('Comment', backref='story', lazy=True, cascade='all, delete-orphan')
     evidence = db.relationship('Evidence', backref='story', lazy=True, cascade='all, delete-orphan')
+    transitions = db.relationship('StateTransition', backref='story', lazy='dynamic', cascade='all, delete-orphan')
     
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,10 +77,51 @@ class Evidence(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False)
     evidence_type = db.Column(db.String(20))
-    file_path = db.Column(db.String(500))
+    file_path = db.Column(db.String(500), index=True)
+    # JSON {kind, args} for images rendered on first request (see render_service.render_once)
+    render_recipe = db.Column(db.Text)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class StateTransition(db.Model):
+    # Append-only state history; the story row only keeps its current state
+    id = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False)
+    state = db.Column(db.String(50), nullable=False)
+    trigger = db.Column(db.String(50))
+    at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    __table_args__ = (db.Index('ix_state_transition_story_at', 'story_id', 'at'),)
+
+class StoryStat(db.Model):
+    # Maintained counters (active stories, stories per state), see story_stats.py
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class SchedulerLease(db.Model):
+    # Lease row used to elect the single process that runs scheduled jobs
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(200))
+    expires_at = db.Column(db.DateTime)
+
+class WorkerLoad(db.Model):
+    # Each worker's AI reply backlog and provider latency, read by the scheduler leader (generation_controller.py)
+    worker = db.Column(db.String(200), primary_key=True)
+    reply_queue_depth = db.Column(db.Integer, nullable=False, default=0)
+    provider_latency_seconds = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class SchedulerRun(db.Model):
+    # Recent runs of each scheduled job (trimmed by scheduler_monitor), readable from every worker
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(100), nullable=False)
+    scheduled_run_time = db.Column(db.DateTime)
+    status = db.Column(db.String(30), nullable=False)
+    duration_seconds = db.Column(db.Float)
+    start_lag_seconds = db.Column(db.Float)
+    overran_interval = db.Column(db.Boolean)
+    error = db.Column(db.Text)
+    __table_args__ = (db.Index('ix_scheduler_run_job_id', 'job_id', 'id'),)
+
 class Follow(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -81,8 +139,42 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-with app.app_context():
-    db.create_all()
+story_stats.register_listeners(Story)
+
+def create_app(config=None):
+    """
+    Build the Flask app. Building it does no I/O: tables and media directories are created by
+    init_db (`flask --app app init-db`, or automatically under `python app.py`).
+    """
+    # Static files go through serve_static / static_cache rather than Flask's built-in static route
+    app = Flask(__name__, static_folder=None)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-horror')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///ai_urban_legends.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if config:
+        app.config.update(config)
+    
+    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    # Evidence image variants; older Pythons don't know these types
+    mimetypes.add_type('image/webp', '.webp')
+    mimetypes.add_type('image/avif', '.avif')
+    db.init_app(app)
+    app.register_blueprint(bp)
+    profiling.init_app(app)
+    
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables, upgrade existing ones and create the media directories."""
+        init_db(app)
+        print("✅ 数据库和媒体目录已就绪")
+    
+    return app
+
+def init_db(app):
+    """Create missing tables, add columns newer models expect to existing ones, and the upload/media directories"""
+    with app.app_context():
+        db.create_all()
+        schema_upgrade.upgrade(db)
     os.makedirs('static/uploads', exist_ok=True)
     os.makedirs('static/generated', exist_ok=True)
     os.makedirs('static/evidence', exist_ok=True)
@@ -91,24 +183,52 @@ def generate_token(user_id):
     return jwt.encode({
         'user_id': user_id,
         'exp': datetime.utcnow() + timedelta(days=30)
-    }, app.config['SECRET_KEY'], algorithm='HS256')
+    }, current_app.config['SECRET_KEY'], algorithm='HS256')
 
 def verify_token(token):
     try:
-        data = jwt.decode(token.replace('Bearer ', ''), app.config['SECRET_KEY'], algorithms=['HS256'])
+        data = jwt.decode(token.replace('Bearer ', ''), current_app.config['SECRET_KEY'], algorithms=['HS256'])
         return data['user_id']
     except:
         return None
 
-@app.route('/')
+@bp.route('/')
 def index():
-    return send_from_directory('static', 'index.html')
+    return send_static('static', 'index.html')
 
-@app.route('/<path:path>')
+@bp.route('/evidence/<path:filename>')
+def serve_evidence(filename):
+    """Evidence images (and their size/format variants) are rendered from the stored recipe on first request"""
+    from render_service import ensure_evidence_file
+    
+    def find_recipe(base_filename):
+        evidence = Evidence.query.filter(
+            Evidence.file_path == f'/evidence/{base_filename}',
+            Evidence.render_recipe.isnot(None)
+        ).first()
+        recipe = json.loads(evidence.render_recipe) if evidence else None
+        db.session.rollback()  # don't hold the read transaction while rendering
+        return recipe
+    
+    try:
+        if not ensure_evidence_file(filename, find_recipe):
+            return jsonify({'error': 'Not found'}), 404
+    except Exception as e:
+        print(f"⚠️ 渲染证据图片失败 {filename}: {e}")
+        return jsonify({'error': 'Render failed'}), 503
+    # Evidence file names are content-addressed, so they can be cached forever
+    return send_static(EVIDENCE_ROOT, relative_path(filename), area='evidence', cache_control=IMMUTABLE)
+
+@bp.route('/generated/<path:filename>')
+def serve_generated(filename):
+    # Audio evidence: uuid-named (ai_engine.generate_evidence_audio), Range requests for seeking
+    return send_static(AUDIO_ROOT, relative_path(filename), area='generated', cache_control=IMMUTABLE)
+
+@bp.route('/<path:path>')
 def serve_static(path):
-    return send_from_directory('static', path)
+    return send_static('static', path)
 
-@app.route('/api/register', methods=['POST'])
+@bp.route('/api/register', methods=['POST'])
 def register():
     data = request.json
     username = data.get('username')
@@ -134,7 +254,7 @@ def register():
         'user': {'id': user.id, 'username': user.username, 'avatar': user.avatar}
     })
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     user = User.query.filter_by(username=data.get('username')).first()
@@ -149,11 +269,11 @@ def login():
         'user': {'id': user.id, 'username': user.username, 'avatar': user.avatar}
     })
 
-@app.route('/api/generate_story', methods=['POST'])
+@bp.route('/api/generate_story', methods=['POST'])
 def generate_new_story():
     """Generate a new AI story on demand"""
     try:
-        from ai_engine import generate_ai_story_with_meta, generate_evidence_image
+        from ai_engine import generate_ai_story_with_meta, plan_evidence_images
         from story_engine import initialize_story_state
         from datetime import datetime, timedelta
         
@@ -173,15 +293,15 @@ def generate_new_story():
             ai_persona=story_data['ai_persona']
         )
         
-        # Initialize state machine
-        new_story = initialize_story_state(new_story)
-        
         db.session.add(new_story)
         db.session.flush()  # 获取story ID
         
-        # 自动生成证据图片
+        # Initialize state machine
+        initialize_story_state(new_story)
+        
+        # 自动生成证据图片（首次访问时才渲染）
         try:
-            evidence_paths = generate_evidence_image(
+            evidence_images = plan_evidence_images(
                 story_data['title'], 
                 story_data['content'],
                 story_data['category']
@@ -196,17 +316,18 @@ def generate_new_story():
                 '【诡异】这张是什么情况？我发誓拍的时候没看到这个...（低光模式，有噪点）'
             ]
             
-            for idx, evidence_path in enumerate(evidence_paths):
+            for idx, image in enumerate(evidence_images):
                 evidence = Evidence(
                     story_id=new_story.id,
                     evidence_type='image',
-                    file_path=evidence_path,
+                    file_path=image['file_path'],
+                    render_recipe=image['render_recipe'],
                     description=evidence_descriptions[idx % len(evidence_descriptions)],
                     created_at=datetime.utcnow() - timedelta(minutes=random.randint(10, 120))
                 )
                 db.session.add(evidence)
             
-            print(f"✅ 为新故事创建了 {len(evidence_paths)} 个证据项")
+            print(f"✅ 为新故事创建了 {len(evidence_images)} 个证据项")
         except Exception as e:
             print(f"⚠️ 生成证据图片失败: {e}")
         
@@ -234,7 +355,7 @@ def generate_new_story():
         print(f"Error in generate_new_story: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/stories', methods=['GET'])
+@bp.route('/api/stories', methods=['GET'])
 def get_stories():
     stories = Story.query.order_by(Story.created_at.desc()).all()
     
@@ -253,8 +374,10 @@ def get_stories():
         'evidence_count': len(s.evidence)
     } for s in stories])
 
-@app.route('/api/stories/<int:story_id>', methods=['GET'])
+@bp.route('/api/stories/<int:story_id>', methods=['GET'])
 def get_story(story_id):
+    from generate_placeholder_images import evidence_srcset
+    
     story = Story.query.get_or_404(story_id)
     story.views += 1
     db.session.commit()
@@ -274,6 +397,8 @@ def get_story(story_id):
             'id': e.id,
             'type': e.evidence_type,
             'file_path': e.file_path,
+            'variants': evidence_srcset(e.file_path)
+                        if e.evidence_type == 'image' and (e.file_path or '').startswith('/evidence/') else None,
             'description': e.description,
             'created_at': e.created_at.isoformat()
         } for e in story.evidence],
@@ -290,7 +415,7 @@ def get_story(story_id):
         } for c in story.comments]
     })
 
-@app.route('/api/stories/<int:story_id>/comments', methods=['POST'])
+@bp.route('/api/stories/<int:story_id>/comments', methods=['POST'])
 def add_comment(story_id):
     token = request.headers.get('Authorization')
     user_id = verify_token(token) if token else None
@@ -321,9 +446,10 @@ def add_comment(story_id):
 
     # 启动后台线程，5秒后生成AI回复（测试用）
     print(f"[add_comment] 启动后台线程，5秒后生成AI回复...")
+    AI_REPLY_QUEUE.inc()
     threading.Thread(
         target=delayed_ai_response,
-        args=(story_id, comment.id, 5),  # 5秒延迟（测试）
+        args=(current_app._get_current_object(), story_id, comment.id, 5),  # 5秒延迟（测试）
         daemon=True
     ).start()
     
@@ -342,7 +468,7 @@ def add_comment(story_id):
         'message': 'AI楼主正在思考回复，请稍候...'
     }), 201
 
-@app.route('/api/stories/<int:story_id>/follow', methods=['POST', 'GET'])
+@bp.route('/api/stories/<int:story_id>/follow', methods=['POST', 'GET'])
 def follow_story(story_id):
     token = request.headers.get('Authorization')
     user_id = verify_token(token)
@@ -365,7 +491,7 @@ def follow_story(story_id):
         db.session.commit()
         return jsonify({'status': 'followed'})
 
-@app.route('/api/notifications', methods=['GET'])
+@bp.route('/api/notifications', methods=['GET'])
 def get_notifications():
     token = request.headers.get('Authorization')
     user_id = verify_token(token)
@@ -382,7 +508,7 @@ def get_notifications():
         'created_at': n.created_at.isoformat()
     } for n in notifications])
 
-@app.route('/api/notifications/read', methods=['POST'])
+@bp.route('/api/notifications/read', methods=['POST'])
 def read_notifications():
     token = request.headers.get('Authorization')
     user_id = verify_token(token)
@@ -400,26 +526,71 @@ def read_notifications():
     db.session.commit()
     return jsonify({'status': 'success'})
 
+def is_admin_request():
+    """Admin endpoints require the X-Admin-Token header to match ADMIN_TOKEN"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token)
+
+@bp.route('/api/admin/stats', methods=['GET'])
+def get_story_stats():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({
+        'active_stories': story_stats.active_story_count(),
+        'states': story_stats.state_counts(),
+        'static_cache': static_cache.cache_stats()
+    })
+
+@bp.route('/api/admin/scheduler', methods=['GET'])
+def get_scheduler_status():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    from scheduler_tasks import scheduler_status
+    return jsonify(scheduler_status())
+
+@bp.route('/api/admin/metrics', methods=['GET'])
+def get_metrics():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(metrics.REGISTRY.snapshot())
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint; the admin token also works as a bearer token (authorization.credentials)"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    bearer = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not (is_admin_request() or (admin_token and hmac.compare_digest(bearer, admin_token))):
+        return jsonify({'error': 'Forbidden'}), 403
+    return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 def create_notifications_for_followers(story, comment, ai_response=False):
-    with app.app_context():
-        followers = Follow.query.filter_by(story_id=story.id).all()
-        for follow in followers:
-            # Don't notify the user who made the comment
-            if not ai_response and follow.user_id == comment.author_id:
-                continue
+    """Runs in the caller's app context, so a request's notification queries count towards its SQL stats"""
+    followers = Follow.query.filter_by(story_id=story.id).all()
+    for follow in followers:
+        # Don't notify the user who made the comment
+        if not ai_response and follow.user_id == comment.author_id:
+            continue
 
-            notification = Notification(
-                user_id=follow.user_id,
-                story_id=story.id,
-                comment_id=comment.id,
-                notification_type='new_reply' if not ai_response else 'story_update',
-                content=f'你关注的故事 "{story.title}" 有了新回复。' if not ai_response else f'你关注的故事 "{story.title}" 有了新进展。'
-            )
-            db.session.add(notification)
-        db.session.commit()
+        notification = Notification(
+            user_id=follow.user_id,
+            story_id=story.id,
+            comment_id=comment.id,
+            notification_type='new_reply' if not ai_response else 'story_update',
+            content=f'你关注的故事 "{story.title}" 有了新回复。' if not ai_response else f'你关注的故事 "{story.title}" 有了新进展。'
+        )
+        db.session.add(notification)
+    db.session.commit()
 
-def delayed_ai_response(story_id, comment_id, delay_seconds=60):
+def delayed_ai_response(app, story_id, comment_id, delay_seconds=60):
     """延迟生成AI回复"""
+    try:
+        _delayed_ai_response(app, story_id, comment_id, delay_seconds)
+    finally:
+        AI_REPLY_QUEUE.dec()
+
+def _delayed_ai_response(app, story_id, comment_id, delay_seconds):
     print(f"[delayed_ai_response] 开始等待 {delay_seconds} 秒... story_id={story_id}, comment_id={comment_id}")
     time.sleep(delay_seconds)
     
@@ -434,7 +605,9 @@ def delayed_ai_response(story_id, comment_id, delay_seconds=60):
         
         print(f"[delayed_ai_response] 调用 generate_ai_response...")
         from ai_engine import generate_ai_response
+        started = time.monotonic()
         ai_response = generate_ai_response(story, comment)
+        record_provider_latency(time.monotonic() - started)
         print(f"[delayed_ai_response] AI回复生成完成: {ai_response[:50]}..." if ai_response else "[delayed_ai_response] AI回复为空!")
         
         if ai_response:
@@ -462,7 +635,13 @@ def delayed_ai_response(story_id, comment_id, delay_seconds=60):
             
             db.session.commit()
 
+# Module-level app for `gunicorn app:app`. Importing it never starts the scheduler: that is done by
+# the server entrypoints only (gunicorn.conf.py, or `python app.py` below)
+app = create_app()
+
 if __name__ == '__main__':
+    init_db(app)
+    
     # Start background scheduler for AI story generation
     from scheduler_tasks import start_scheduler
     scheduler = start_scheduler(app)
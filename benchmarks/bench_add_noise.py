@@ -0,0 +1,125 @@
+"""
+add_noise 基准测试 - 对比逐像素的旧实现和 numpy 向量化实现的耗时，并检查两者输出的统计特征一致
+
+用法:
+    python benchmarks/bench_add_noise.py --repeat 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generate_placeholder_images import add_noise
+
+
+def legacy_add_noise(img, intensity=0.15):
+    """The original per-pixel implementation, kept as the reference"""
+    pixels = img.load()
+    width, height = img.size
+    for i in range(width):
+        for j in range(height):
+            if random.random() < intensity:
+                r, g, b = pixels[i, j]
+                noise = random.randint(-30, 30)
+                pixels[i, j] = (
+                    max(0, min(255, r + noise)),
+                    max(0, min(255, g + noise)),
+                    max(0, min(255, b + noise))
+                )
+    return img
+
+
+def timed(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return min(durations), sum(durations) / len(durations)
+
+
+def noise_stats(before, after):
+    """Fraction of pixels touched, offset distribution and whether channels moved together"""
+    delta = np.asarray(after, dtype=np.int16) - np.asarray(before, dtype=np.int16)
+    touched = np.any(delta != 0, axis=2)
+    offsets = delta[..., 0][touched]
+    return {
+        'touched': touched.mean(),
+        'mean': offsets.mean(),
+        'std': offsets.std(),
+        'histogram': np.bincount(offsets + 30, minlength=61) / max(1, offsets.size),
+        'same_offset_all_channels': bool(np.all(delta[..., 0] == delta[..., 1]) and
+                                         np.all(delta[..., 1] == delta[..., 2]))
+    }
+
+
+def check_equivalence(width, height, intensity, seed):
+    """
+    On a mid-gray image no offset gets clipped, so both versions should draw from the
+    same distribution: P(touched) = intensity * 60/61, offsets uniform on [-30, 30] \\ {0}.
+    """
+    base = Image.new('RGB', (width, height), (128, 128, 128))
+    random.seed(seed)
+    legacy = noise_stats(base, legacy_add_noise(base.copy(), intensity))
+    vectorized = noise_stats(base, add_noise(base.copy(), intensity, rng=seed))
+
+    expected_touched = intensity * 60 / 61
+    tolerance = 4 * np.sqrt(expected_touched * (1 - expected_touched) / (width * height))
+    total_variation = 0.5 * np.abs(legacy['histogram'] - vectorized['histogram']).sum()
+
+    checks = {
+        'touched fraction (legacy)': abs(legacy['touched'] - expected_touched) < tolerance,
+        'touched fraction (vectorized)': abs(vectorized['touched'] - expected_touched) < tolerance,
+        'offset mean ~ 0': abs(vectorized['mean']) < 0.5,
+        'offset std matches': abs(legacy['std'] - vectorized['std']) < 0.5,
+        'offset histogram TV distance < 0.02': total_variation < 0.02,
+        'channels share one offset': vectorized['same_offset_all_channels'],
+        'seeded output reproducible': np.array_equal(
+            np.asarray(add_noise(base, intensity, rng=seed)),
+            np.asarray(add_noise(base, intensity, rng=seed))
+        ),
+    }
+    return legacy, vectorized, total_variation, checks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark and verify add_noise')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    parser.add_argument('--intensity', type=float, default=0.35)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    source = Image.fromarray(rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8), 'RGB')
+
+    legacy_best, legacy_mean = timed(lambda: legacy_add_noise(source.copy(), args.intensity), args.repeat)
+    fast_best, fast_mean = timed(lambda: add_noise(source, args.intensity), args.repeat)
+    print(f"📐 {args.width}x{args.height}, intensity={args.intensity}, repeat={args.repeat}")
+    print(f"  legacy      best {legacy_best * 1000:9.1f} ms   mean {legacy_mean * 1000:9.1f} ms")
+    print(f"  vectorized  best {fast_best * 1000:9.1f} ms   mean {fast_mean * 1000:9.1f} ms")
+    print(f"  speedup     {legacy_best / fast_best:.0f}x")
+
+    legacy, vectorized, total_variation, checks = check_equivalence(
+        args.width, args.height, args.intensity, args.seed
+    )
+    print("\n统计一致性:")
+    print(f"  touched   legacy {legacy['touched']:.4f}  vectorized {vectorized['touched']:.4f}  "
+          f"expected {args.intensity * 60 / 61:.4f}")
+    print(f"  offsets   legacy mean {legacy['mean']:+.3f} std {legacy['std']:.3f}  "
+          f"vectorized mean {vectorized['mean']:+.3f} std {vectorized['std']:.3f}")
+    print(f"  histogram total variation distance {total_variation:.4f}")
+    for name, passed in checks.items():
+        print(f"  {'✅' if passed else '❌'} {name}")
+
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+apply_halftone_effect 基准测试 - 对比逐格 draw.ellipse 的旧实现和按半径预栅格化的批量实现，
+并逐像素比对两者输出（回归检查，任何差异都返回非零退出码）
+
+用法:
+    python benchmarks/bench_halftone.py --sizes 800x600 1600x1200 --samples 4 8 12
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generate_placeholder_images import apply_halftone_effect
+
+
+def legacy_apply_halftone_effect(img, sample=8):
+    """The original per-cell implementation, kept as the reference"""
+    width, height = img.size
+    img_small = img.resize((width // sample, height // sample), Image.Resampling.LANCZOS)
+
+    result = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(result)
+
+    for y in range(img_small.height):
+        for x in range(img_small.width):
+            pixel_value = img_small.getpixel((x, y))
+            dot_size = int((1 - pixel_value / 255) * sample * 0.9)
+
+            if dot_size > 0:
+                x_pos = x * sample + sample // 2
+                y_pos = y * sample + sample // 2
+                draw.ellipse([
+                    x_pos - dot_size, y_pos - dot_size,
+                    x_pos + dot_size, y_pos + dot_size
+                ], fill=0)
+
+    return result
+
+
+def test_image(width, height, seed):
+    """Blurred random noise: smooth regions plus the full range of grey levels"""
+    rng = np.random.default_rng(seed)
+    noise = Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8), 'L')
+    return noise.filter(ImageFilter.GaussianBlur(radius=6)).point(lambda v: min(255, max(0, (v - 96) * 4)))
+
+
+def timed(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark and verify apply_halftone_effect')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[(800, 600), (1003, 757), (1600, 1200)])
+    parser.add_argument('--samples', nargs='+', type=int, default=[4, 8, 12])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    failures = 0
+    print(f"{'size':>11} {'sample':>7} {'cells':>8} {'legacy ms':>10} {'fast ms':>9} {'speedup':>8}  diff")
+    for width, height in args.sizes:
+        img = test_image(width, height, args.seed)
+        for sample in args.samples:
+            expected = np.asarray(legacy_apply_halftone_effect(img, sample))
+            actual = np.asarray(apply_halftone_effect(img, sample))
+            differing = int(np.count_nonzero(expected != actual))
+            failures += differing > 0
+
+            legacy_time = timed(lambda: legacy_apply_halftone_effect(img, sample), args.repeat)
+            fast_time = timed(lambda: apply_halftone_effect(img, sample), args.repeat)
+            cells = (width // sample) * (height // sample)
+            print(f"{width:>5}x{height:<5} {sample:>7} {cells:>8} {legacy_time * 1000:>10.1f} "
+                  f"{fast_time * 1000:>9.1f} {legacy_time / fast_time:>7.1f}x  "
+                  f"{'✅ identical' if not differing else f'❌ {differing} pixels differ'}")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+冷启动导入耗时基准 - 在全新的子进程里用 `python -X importtime` 导入各模块，
+取多次运行的中位数，列出最重的直接依赖，超出预算（毫秒）时返回非零退出码
+
+用法:
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --modules app ai_engine --repeat 7 --budget app=400
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start budgets in ms; ai_engine's is tight so an SDK import creeping back to module level fails
+DEFAULT_BUDGETS = {
+    'app': 500,
+    'ai_engine': 100,
+    'story_engine': 400,
+    'seed': 500,
+}
+
+
+def import_profile(module):
+    """One fresh interpreter importing module: [(depth, cumulative µs, name)] in the order -X importtime prints"""
+    env = dict(os.environ, DATABASE_URL='sqlite://', PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    profile = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        profile.append((depth, int(cumulative), name.strip()))
+    return profile
+
+
+def total_us(profile, module):
+    """Cumulative time of the top-level import (a module can be listed again deeper down)"""
+    return next(cumulative for depth, cumulative, name in reversed(profile) if depth == 0 and name == module)
+
+
+def heaviest_children(profile, module, top):
+    """The module's direct imports (one level below it), heaviest first"""
+    # -X importtime prints children before their parent; walk back from the module's line
+    end = max(i for i, (depth, _, name) in enumerate(profile) if depth == 0 and name == module)
+    children = []
+    for depth, cumulative, name in reversed(profile[:end]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((cumulative, name))
+    return sorted(children, reverse=True)[:top]
+
+
+def parse_budget(text):
+    module, ms = text.split('=')
+    return module, float(ms)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold-start import time of the app modules')
+    parser.add_argument('--modules', nargs='+', default=list(DEFAULT_BUDGETS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='heaviest direct imports to list per module')
+    parser.add_argument('--budget', nargs='+', type=parse_budget, default=[], metavar='MODULE=MS',
+                        help='override a budget (default: %s)' % DEFAULT_BUDGETS)
+    args = parser.parse_args(argv)
+
+    budgets = dict(DEFAULT_BUDGETS, **dict(args.budget))
+    over = 0
+    print(f"{'module':<14} {'median ms':>10} {'min ms':>8} {'budget':>8}")
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        times = [total_us(run, module) / 1000 for run in runs]
+        median = statistics.median(times)
+        budget = budgets.get(module)
+        failed = budget is not None and median > budget
+        over += failed
+        status = '' if budget is None else ('  ❌ over budget' if failed else '  ✅')
+        print(f"{module:<14} {median:>10.1f} {min(times):>8.1f} {budget if budget is not None else '-':>8}{status}")
+        for cumulative, name in heaviest_children(runs[-1], module, args.top):
+            print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+KeywordMatcher 基准测试 - 对比旧的逐个关键词 `in` 扫描和共享匹配器（关键词提取、逐句过滤），
+以及找出全部重叠位置的开销：逐个关键词 str.find、KeywordMatcher 和其他一遍扫描方案（纯 Python Aho-Corasick、前瞻正则），
+并核对所有结果（任何差异都返回非零退出码）
+
+--density 是每个字符位置插入关键词的概率：默认 0.02 接近 seed.py 里的故事；
+关键词非常密集时（如 0.15）每个关键词的 `in` 很快就命中返回，逐个扫描反而更快
+
+用法:
+    python benchmarks/bench_keyword_matcher.py --lengths 200 2000 20000 --repeat 200 [--density 0.15]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from keyword_matcher import KeywordMatcher
+from ai_engine import META_SENTENCE_WORDS as META_MATCHER, REPLY_SENTENCE_WORDS as REPLY_MATCHER
+from generate_placeholder_images import STORY_KEYWORDS, extract_keywords_from_story
+
+# The reply filter's word lists, as the legacy code scanned them
+META_SENTENCE_WORDS = list(META_MATCHER.keywords)
+REPLY_SENTENCE_WORDS = list(REPLY_MATCHER.keywords)
+
+FILLER = '那天晚上雨很大我一个人走回家路灯一闪一闪的后面好像有人跟着但回头又什么都没有'
+
+
+def legacy_extract(content):
+    return [keyword for keyword in STORY_KEYWORDS if keyword in content][:10]
+
+
+def legacy_filter(text):
+    kept = []
+    for sent in re.split(r'[。！？]', text):
+        sent = sent.strip()
+        if not sent or any(word in sent for word in META_SENTENCE_WORDS):
+            continue
+        if any(word in sent for word in REPLY_SENTENCE_WORDS):
+            kept.append(sent)
+    return kept
+
+
+def matcher_filter(text):
+    kept = []
+    for sent in re.split(r'[。！？]', text):
+        sent = sent.strip()
+        if not sent or META_MATCHER.contains_any(sent):
+            continue
+        if REPLY_MATCHER.contains_any(sent):
+            kept.append(sent)
+    return kept
+
+
+class AhoCorasick:
+    """Pure-Python Aho-Corasick automaton: one pass over the text, every state transition in Python"""
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.goto, self.fail, self.output = [{}], [0], [()]
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = self.goto[state][char]
+            self.output[state] += (index,)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] += self.output[self.fail[child]]
+                queue.append(child)
+
+    def find_all(self, text):
+        found, state = [], 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for index in self.output[state]:
+                found.append((position + 1 - len(self.keywords[index]), self.keywords[index]))
+        return found
+
+
+class LookaheadRegex:
+    """One regex pass: a zero-width lookahead reports the longest keyword at each position, its prefixes the rest"""
+
+    def __init__(self, keywords):
+        by_length = sorted(keywords, key=len, reverse=True)
+        self.prefixes = {k: [o for o in keywords if k.startswith(o)] for k in keywords}
+        self.pattern = re.compile(f"(?=({'|'.join(map(re.escape, by_length))}))")
+
+    def find_all(self, text):
+        return [(hit.start(), keyword) for hit in self.pattern.finditer(text) for keyword in self.prefixes[hit.group(1)]]
+
+
+def brute_force(keywords, text):
+    """Every (start, keyword) occurrence, overlapping ones included"""
+    found = set()
+    for keyword in keywords:
+        start = text.find(keyword)
+        while start != -1:
+            found.add((start, keyword))
+            start = text.find(keyword, start + 1)
+    return found
+
+
+def sample_text(length, rng, density):
+    """Filler prose with keywords, sentence ends and meta phrases sprinkled in"""
+    pieces = STORY_KEYWORDS + META_SENTENCE_WORDS + REPLY_SENTENCE_WORDS + ['。', '！', '？']
+    chars = []
+    while len(chars) < length:
+        if rng.random() < density:
+            chars.extend(rng.choice(pieces))
+        else:
+            chars.append(rng.choice(FILLER))
+    return ''.join(chars[:length])
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark and verify KeywordMatcher')
+    parser.add_argument('--lengths', nargs='+', type=int, default=[200, 2000, 20000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--density', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    story_matcher = KeywordMatcher(STORY_KEYWORDS)
+    automaton = AhoCorasick(STORY_KEYWORDS)
+    lookahead = LookaheadRegex(STORY_KEYWORDS)
+    failures = 0
+    print(f"{'chars':>7} {'task':<10} {'implementation':<16} {'µs':>9} {'vs legacy':>10}  check")
+    for length in args.lengths:
+        text = sample_text(length, rng, args.density)
+        expected_hits = brute_force(STORY_KEYWORDS, text)
+        # The meta words overlap ('作为楼主，我' / '我需要'), which takes the matcher's slower path
+        expected_meta_hits = brute_force(META_SENTENCE_WORDS, text)
+
+        def same_hits(hits, expected=expected_hits):
+            return len(hits) == len(expected) and set(hits) == expected
+
+        def matcher_hits(matcher):
+            return [(match.start, match.keyword) for match in matcher.find_all(text)]
+
+        # (task, implementation, call, correct); the first row of each task is the reference
+        rows = [
+            ('keywords', 'legacy in', lambda: legacy_extract(text), True),
+            ('keywords', 'KeywordMatcher', lambda: extract_keywords_from_story(text),
+             legacy_extract(text) == extract_keywords_from_story(text)),
+            ('sentences', 'legacy in', lambda: legacy_filter(text), True),
+            ('sentences', 'KeywordMatcher', lambda: matcher_filter(text), legacy_filter(text) == matcher_filter(text)),
+            ('positions', 'str.find', lambda: brute_force(STORY_KEYWORDS, text), True),
+            ('positions', 'KeywordMatcher', lambda: story_matcher.find_all(text),
+             same_hits(matcher_hits(story_matcher))),
+            ('positions', 'aho-corasick', lambda: automaton.find_all(text), same_hits(automaton.find_all(text))),
+            ('positions', 'lookahead regex', lambda: lookahead.find_all(text), same_hits(lookahead.find_all(text))),
+            ('overlaps', 'str.find', lambda: brute_force(META_SENTENCE_WORDS, text), True),
+            ('overlaps', 'KeywordMatcher', lambda: META_MATCHER.find_all(text),
+             same_hits(matcher_hits(META_MATCHER), expected_meta_hits)),
+        ]
+        reference = {}
+        for task, name, call, ok in rows:
+            failures += not ok
+            elapsed = timed(call, args.repeat)
+            reference.setdefault(task, elapsed)
+            print(f"{length:>7} {task:<10} {name:<16} {elapsed * 1e6:>9.1f} {reference[task] / elapsed:>9.2f}x  "
+                  f"{'✅' if ok else '❌ results differ'}")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+证据图片渲染流水线基准测试 - 按阶段（渐变、形状、半色调、噪点、暗角、编码…）统计
+create_found_footage_image / create_abstract_image 在多种尺寸和 seed 下的耗时 mean/p95 和峰值分配，
+可保存基线并与之对比（任何阶段退化超过阈值返回非零退出码）
+
+用法:
+    python benchmarks/bench_render.py --sizes 400x300 800x600 1600x1200 --seeds 5
+    python benchmarks/bench_render.py --save-baseline render-baseline.json
+    python benchmarks/bench_render.py --compare render-baseline.json --threshold 0.2
+
+峰值分配来自 tracemalloc（单独一轮，避免追踪开销污染计时）：numpy 数组会被统计，
+Pillow 自己 malloc 的像素缓冲区不会。
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import PIL
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import generate_placeholder_images as gpi
+
+SCENE_TYPES = ['dark', 'indoor', 'outdoor']
+COLOR_SCHEMES = ['dark', 'blood', 'cold', 'decay']
+
+
+def recipes(kinds):
+    """(name, render(filename, seed, size, stages)) for every scene type / colour scheme"""
+    if 'found_footage' in kinds:
+        for scene in SCENE_TYPES:
+            yield f'found_footage/{scene}', lambda filename, seed, size, stages, scene=scene: \
+                gpi.create_found_footage_image(filename, 'DO NOT ENTER', scene, seed=seed, size=size, stages=stages)
+    if 'abstract' in kinds:
+        for scheme in COLOR_SCHEMES:
+            yield f'abstract/{scheme}', lambda filename, seed, size, stages, scheme=scheme: \
+                gpi.create_abstract_image(filename, scheme, seed=seed, size=size, stages=stages)
+
+
+def run_once(render, seed, size):
+    """One render; returns the per-stage dict plus a 'total' entry"""
+    stages = {}
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        render('bench.jpg', seed, size, stages)
+    elapsed = time.perf_counter() - started
+    # The stages reset the peak as they go, so the whole-render peak is the largest stage peak
+    peak = max(entry['peak_bytes'] for entry in stages.values()) if tracemalloc.is_tracing() else 0
+    stages['total'] = {'seconds': elapsed, 'peak_bytes': peak}
+    return stages
+
+
+def p95(values):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+def measure(render, size, seeds, warmup):
+    """Per stage: mean/p95 in ms over every seed, and the peak traced allocation over a separate pass"""
+    for i in range(warmup):
+        run_once(render, f'warmup-{i}', size)
+
+    timings = {}
+    for seed in seeds:
+        for name, entry in run_once(render, seed, size).items():
+            timings.setdefault(name, []).append(entry['seconds'] * 1000)
+
+    tracemalloc.start()
+    try:
+        traced = run_once(render, seeds[0], size)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        name: {
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p95_ms': round(p95(values), 3),
+            'peak_kb': round(traced.get(name, {}).get('peak_bytes', 0) / 1024, 1)
+        }
+        for name, values in timings.items()
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def print_results(results):
+    print(f"{'recipe':<22} {'size':>10} {'stage':<11} {'mean ms':>9} {'p95 ms':>9} {'peak KB':>9}")
+    for key, stages in results.items():
+        recipe, size = key.rsplit('@', 1)
+        for name, row in sorted(stages.items(), key=lambda item: item[0] == 'total'):
+            print(f"{recipe:<22} {size:>10} {name:<11} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['peak_kb']:>9.1f}")
+
+
+def compare(results, baseline, threshold, min_ms):
+    """Print the mean-time delta of every stage against the baseline; returns the number of regressions"""
+    base_env = baseline.get('environment', {})
+    print(f"\n对比基线: {base_env.get('timestamp', '?')} "
+          f"(python {base_env.get('python', '?')}, Pillow {base_env.get('pillow', '?')}, numpy {base_env.get('numpy', '?')})")
+    print(f"{'recipe@size':<33} {'stage':<11} {'base ms':>9} {'now ms':>9} {'delta':>8}")
+
+    regressions = 0
+    for key, stages in results.items():
+        base_stages = baseline['results'].get(key)
+        if base_stages is None:
+            continue
+        for name, row in stages.items():
+            base = base_stages.get(name)
+            if base is None or base['mean_ms'] <= 0:
+                continue
+            delta = (row['mean_ms'] - base['mean_ms']) / base['mean_ms']
+            regressed = delta > threshold and row['mean_ms'] - base['mean_ms'] >= min_ms
+            regressions += regressed
+            print(f"{key:<33} {name:<11} {base['mean_ms']:>9.2f} {row['mean_ms']:>9.2f} {delta:>+7.0%}"
+                  f"{'  ❌ regression' if regressed else ''}")
+    return regressions
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-stage benchmark of the evidence image renderers')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[(400, 300), (800, 600), (1600, 1200)])
+    parser.add_argument('--seeds', type=int, default=5, help='renders per recipe and size')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed renders first (fills the gradient caches)')
+    parser.add_argument('--kinds', nargs='+', choices=['found_footage', 'abstract'], default=['found_footage', 'abstract'])
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown per stage')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='ignore slowdowns smaller than this (noise floor)')
+    args = parser.parse_args(argv)
+
+    # Loaded before chdir so relative paths keep working
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    baseline_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    seeds = [f'bench-{i}' for i in range(args.seeds)]
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Renderers write to static/evidence relative to the working directory
+        os.chdir(workdir)
+        try:
+            for name, render in recipes(args.kinds):
+                for width, height in args.sizes:
+                    results[f'{name}@{width}x{height}'] = measure(render, (width, height), seeds, args.warmup)
+        finally:
+            os.chdir(cwd)
+
+    print_results(results)
+
+    if baseline_path:
+        with open(baseline_path, 'w') as f:
+            json.dump({'environment': environment(), 'seeds': args.seeds, 'results': results}, f, indent=2)
+        print(f"\n💾 基线已保存: {baseline_path}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        if regressions:
+            print(f"\n❌ {regressions} 个阶段退化超过 {args.threshold:.0%}")
+            return 1
+        print(f"\n✅ 没有阶段退化超过 {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
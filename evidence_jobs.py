@@ -0,0 +1,53 @@
+"""
+证据生成任务队列 - 状态转换提交后，由工作线程池渲染图片/音频并挂载到故事
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Shared worker pool for evidence jobs (size from EVIDENCE_WORKERS)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.getenv('EVIDENCE_WORKERS', 4))
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='evidence')
+        return _executor
+
+
+def enqueue_state_evidence(story_id, state, media_types):
+    """
+    Queue image/audio generation for a committed state change, returns a Future.
+    Call inside an app context: the job runs against that app.
+    """
+    app = current_app._get_current_object()
+    return get_executor().submit(_run_state_evidence_job, app, story_id, state, media_types)
+
+
+def _run_state_evidence_job(app, story_id, state, media_types):
+    from app import db
+    from story_engine import generate_state_media
+
+    with app.app_context():
+        try:
+            count = generate_state_media(story_id, state, media_types)
+            print(f"✅ 故事 {story_id} ({state}) 新增 {count} 个证据")
+            return count
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ 生成状态证据失败 story_id={story_id}: {e}")
+            return 0
+
+
+def shutdown(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,214 @@
+"""
+证据文件存储布局 - 按文件名 md5 分两级目录存放（URL 仍是扁平的 /evidence/<name>），
+附带旧的扁平目录迁移和孤儿文件回收
+
+用法:
+    python evidence_storage.py migrate
+    python evidence_storage.py gc [--dry-run]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+import metrics
+
+# Also run as a CLI, where nothing else has loaded .env before the settings below are read
+load_dotenv()
+
+EVIDENCE_ROOT = os.path.join('static', 'evidence')
+AUDIO_ROOT = os.path.join('static', 'generated')
+
+# Append-only record of which recipe (and renderer version) produced each evidence image, compacted
+# by render_evidence.py. Kept outside static/ so it is neither served nor seen by the garbage collector.
+MANIFEST_PATH = os.getenv('EVIDENCE_MANIFEST', 'evidence_manifest.jsonl')
+
+# Files younger than this are never collected: their Evidence row may not be committed yet
+GC_MIN_AGE_SECONDS = int(os.getenv('EVIDENCE_GC_MIN_AGE_SECONDS', 3600))
+
+GC_DELETED = metrics.counter('evidence_gc_deleted_files_total', 'Orphaned evidence files deleted')
+GC_RECLAIMED = metrics.counter('evidence_gc_reclaimed_bytes_total', 'Bytes reclaimed by evidence GC')
+
+
+def shard_key(filename):
+    """
+    Everything before the first dot, so an image, its size/format variants and its temp files
+    (x.jpg, x.thumb.webp, x.jpg.123.tmp) share one directory
+    """
+    return filename.split('.', 1)[0]
+
+
+def shard_dir(filename):
+    digest = hashlib.md5(shard_key(filename).encode()).hexdigest()
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def relative_path(filename):
+    """Path of a file below its root: ab/cd/<filename>"""
+    return os.path.join(shard_dir(filename), filename)
+
+
+def sharded_path(root, filename):
+    return os.path.join(root, relative_path(filename))
+
+
+def evidence_file(filename):
+    return sharded_path(EVIDENCE_ROOT, filename)
+
+
+def audio_file(filename):
+    return sharded_path(AUDIO_ROOT, filename)
+
+
+def recipe_hash(recipe, version):
+    """Stable hash of a render recipe ({kind, args}) and the renderer version that applies it"""
+    payload = json.dumps({'kind': recipe['kind'], 'args': list(recipe['args']), 'version': version},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def record_render(filename, recipe, version):
+    """
+    Append one manifest line after a render. Lines are small single writes in append mode,
+    so concurrent render workers don't interleave them.
+    """
+    line = json.dumps({'file': filename, 'hash': recipe_hash(recipe, version), 'version': version,
+                       'rendered_at': int(time.time())}, ensure_ascii=False)
+    with open(MANIFEST_PATH, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+def read_manifest():
+    """file name -> latest manifest entry (later lines win; a torn last line is skipped)"""
+    entries = {}
+    if not os.path.exists(MANIFEST_PATH):
+        return entries
+    with open(MANIFEST_PATH, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['file']] = entry
+    return entries
+
+
+def compact_manifest():
+    """
+    Rewrite the manifest with only the latest entry of each file still on disk; returns the number
+    of entries kept. A render recorded by another process during the rewrite can be lost, which
+    only makes that file 'untracked' (adopted as-is) on the next batch run.
+    """
+    entries = read_manifest()
+    tmp_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    kept = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for filename, entry in entries.items():
+            if os.path.exists(evidence_file(filename)):
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                kept += 1
+    os.replace(tmp_path, MANIFEST_PATH)
+    return kept
+
+
+def migrate_flat_layout(root):
+    """Move files sitting directly in root into their shard directory; returns how many moved"""
+    moved = 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            target = sharded_path(root, entry.name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            moved += 1
+    return moved
+
+
+def _walk_files(root):
+    """Stream every file below root without building the full listing"""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def _referenced_names():
+    """Base names (shard keys) of every file an Evidence row points to"""
+    from app import db, Evidence
+
+    names = set()
+    for (file_path,) in db.session.query(Evidence.file_path).filter(
+            Evidence.file_path.isnot(None)).yield_per(1000):
+        names.add(shard_key(file_path.rsplit('/', 1)[-1]))
+    db.session.rollback()
+    return names
+
+
+def collect_garbage(dry_run=False):
+    """
+    Delete evidence/audio files that no Evidence row references (variants follow their image).
+    Needs an app context. Returns a report dict.
+    """
+    started = time.monotonic()
+    referenced = _referenced_names()
+    cutoff = time.time() - GC_MIN_AGE_SECONDS
+    report = {'files_scanned': 0, 'files_deleted': 0, 'bytes_reclaimed': 0, 'dry_run': dry_run}
+
+    for root in (EVIDENCE_ROOT, AUDIO_ROOT):
+        if not os.path.isdir(root):
+            continue
+        for entry in _walk_files(root):
+            report['files_scanned'] += 1
+            if shard_key(entry.name) in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                GC_DELETED.inc()
+                GC_RECLAIMED.inc(stat.st_size)
+            report['files_deleted'] += 1
+            report['bytes_reclaimed'] += stat.st_size
+
+    report['duration_seconds'] = round(time.monotonic() - started, 3)
+    action = '可回收' if dry_run else '已删除'
+    print(f"🧹 证据清理: 扫描 {report['files_scanned']} 个文件，{action} {report['files_deleted']} 个，"
+          f"{report['bytes_reclaimed'] / 1024 / 1024:.1f} MB")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evidence storage maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('migrate', help='move files from the flat layout into shard directories')
+    gc_parser = sub.add_parser('gc', help='delete files no Evidence row references')
+    gc_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        for root in (EVIDENCE_ROOT, AUDIO_ROOT):
+            if os.path.isdir(root):
+                print(f"📦 {root}: 迁移 {migrate_flat_layout(root)} 个文件")
+        return 0
+
+    from app import create_app
+    with create_app().app_context():
+        collect_garbage(dry_run=args.dry_run)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,80 +1,253 @@
 """
 生成伪纪录片/手机拍摄风格的占位图片
 """
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance, features
+import numpy as np
 import random
 import os
 import hashlib
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import lru_cache
+from evidence_storage import evidence_file
+from keyword_matcher import KeywordMatcher
 
-def add_noise(img, intensity=0.15):
-    """添加噪点"""
-    pixels = img.load()
-    width, height = img.size
-    for i in range(width):
-        for j in range(height):
-            if random.random() < intensity:
-                r, g, b = pixels[i, j]
-                noise = random.randint(-30, 30)
-                pixels[i, j] = (
-                    max(0, min(255, r + noise)),
-                    max(0, min(255, g + noise)),
-                    max(0, min(255, b + noise))
-                )
-    return img
+# 改动特效导致输出变化时递增，render_evidence.py 会据此重新渲染旧图
+RENDER_VERSION = 1
+
+@contextmanager
+def _stage(stages, name):
+    """
+    累计一个渲染阶段的耗时到 stages[name]（stages 为 None 时不计时）；
+    tracemalloc 开启时顺带记录该阶段的峰值分配
+    """
+    if stages is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = stages.setdefault(name, {'seconds': 0.0, 'peak_bytes': 0})
+        entry['seconds'] += time.perf_counter() - started
+        if tracing:
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            entry['peak_bytes'] = max(entry['peak_bytes'], peak)
 
-def add_vignette(img):
+def add_noise(img, intensity=0.15, rng=None):
+    """
+    添加噪点
+    rng 可传入 numpy Generator 或整数种子，便于复现；默认每次随机
+    """
+    rng = np.random.default_rng(rng)
+    pixels = np.asarray(img, dtype=np.int16)
+    height, width = pixels.shape[:2]
+    # 每个像素以 intensity 的概率加上 [-30, 30] 的偏移，各颜色通道相同（L 图只有一个通道）
+    hit = rng.random((height, width)) < intensity
+    offset = rng.integers(-30, 31, size=(height, width), dtype=np.int16) * hit
+    if pixels.ndim == 2:
+        pixels += offset
+    else:
+        # 透明通道（RGBA/LA）保持不变
+        color_bands = pixels.shape[2] - ('A' in img.getbands())
+        pixels[..., :color_bands] += offset[..., np.newaxis]
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), img.mode)
+
+@lru_cache(maxsize=16)
+def vignette_mask(width, height, strength=180):
+    """暗角蒙版（L 模式）只取决于尺寸和强度，按参数缓存；调用方不要修改返回的图片"""
+    # 距离中心的归一化距离
+    dx = (np.arange(width) - width / 2) / (width / 2)
+    dy = (np.arange(height) - height / 2) / (height / 2)
+    distance = np.sqrt(dx[np.newaxis, :] ** 2 + dy[:, np.newaxis] ** 2)
+    # 暗角强度
+    brightness = np.maximum(0, 255 - (distance * strength).astype(np.int32))
+    return Image.fromarray(brightness.astype(np.uint8), 'L')
+
+def add_vignette(img, strength=180):
     """添加暗角效果"""
-    width, height = img.size
-    mask = Image.new('L', (width, height), 0)
-    draw = ImageDraw.Draw(mask)
-    
-    # 创建径向渐变
-    for y in range(height):
-        for x in range(width):
-            # 计算距离中心的距离
-            dx = (x - width/2) / (width/2)
-            dy = (y - height/2) / (height/2)
-            distance = (dx**2 + dy**2)**0.5
-            # 暗角强度
-            brightness = max(0, 255 - int(distance * 180))
-            draw.point((x, y), fill=brightness)
-    
-    # 应用暗角
-    vignette = Image.new('RGB', img.size, (0, 0, 0))
+    mask = vignette_mask(img.width, img.height, strength)
+    vignette = Image.new(img.mode, img.size, 0)
     return Image.composite(img, vignette, mask)
 
+@lru_cache(maxsize=16)
+def _halftone_stamps(max_radius):
+    """
+    按半径预先栅格化的圆点：stamps[r] 是 (2R+1)x(2R+1) 的白底图块，中心画半径 r 的黑点，
+    与 draw.ellipse 的光栅化结果一致；stamps[0] 为全白
+    """
+    size = 2 * max_radius + 1
+    stamps = np.full((max_radius + 1, size, size), 255, dtype=np.uint8)
+    for radius in range(1, max_radius + 1):
+        stamp = Image.new('L', (size, size), 255)
+        ImageDraw.Draw(stamp).ellipse([
+            max_radius - radius, max_radius - radius,
+            max_radius + radius, max_radius + radius
+        ], fill=0)
+        stamps[radius] = np.asarray(stamp)
+    return stamps
+
 def apply_halftone_effect(img, sample=8):
     """
     应用半色调/网点效果 - Brutalism风格的关键
+    按采样格缩小后，每格根据亮度画一个圆点。圆点图块按半径预先栅格化后按亮度查表取出；
+    相邻格的圆点会重叠，所以按 (行 % step, 列 % step) 分组，同组图块互不重叠，每组一次写入
     """
     width, height = img.size
     img_small = img.resize((width // sample, height // sample), Image.Resampling.LANCZOS)
     
-    # 创建新图片
-    result = Image.new('L', (width, height), 255)
-    draw = ImageDraw.Draw(result)
-    
-    # 为每个采样点绘制圆点
-    for y in range(img_small.height):
-        for x in range(img_small.width):
-            pixel_value = img_small.getpixel((x, y))
-            # 根据亮度计算圆点大小
-            dot_size = int((1 - pixel_value / 255) * sample * 0.9)
-            
-            if dot_size > 0:
-                x_pos = x * sample + sample // 2
-                y_pos = y * sample + sample // 2
-                draw.ellipse([
-                    x_pos - dot_size, y_pos - dot_size,
-                    x_pos + dot_size, y_pos + dot_size
-                ], fill=0)
-    
-    return result
+    # 根据亮度计算圆点大小
+    luminance = np.asarray(img_small, dtype=np.float64)
+    dot_sizes = ((1 - luminance / 255) * sample * 0.9).astype(np.intp)
+    rows, cols = dot_sizes.shape
+    
+    max_radius = int(sample * 0.9)
+    stamps = _halftone_stamps(max_radius)
+    tile = stamps.shape[1]
+    step = -(-tile // sample)  # 图块跨越的格数
+    block = step * sample
+    
+    # 四周留边，超出画布的圆点部分最后裁掉
+    pad = max_radius
+    canvas = np.full((max(height, rows * sample) + 2 * pad + block,
+                      max(width, cols * sample) + 2 * pad + block), 255, dtype=np.uint8)
+    origin = pad + sample // 2 - max_radius
+    
+    for gy in range(min(step, rows)):
+        for gx in range(min(step, cols)):
+            sizes = dot_sizes[gy::step, gx::step]
+            n_rows, n_cols = sizes.shape
+            y0 = origin + gy * sample
+            x0 = origin + gx * sample
+            region = canvas[y0:y0 + n_rows * block, x0:x0 + n_cols * block]
+            blocks = region.reshape(n_rows, block, n_cols, block)[:, :tile, :, :tile]
+            tiles = stamps[sizes].transpose(0, 2, 1, 3)
+            np.minimum(blocks, tiles, out=blocks)
+    
+    result = canvas[pad:pad + height, pad:pad + width]
+    return Image.fromarray(np.ascontiguousarray(result), 'L')
+
+def _vertical_gradient(rows, width):
+    """把每行一个颜色的 1 像素宽色带横向拉伸成整张背景"""
+    strip = Image.new('RGB', (1, len(rows)))
+    strip.putdata(rows)
+    return strip.resize((width, len(rows)), Image.Resampling.NEAREST)
+
+@lru_cache(maxsize=16)
+def footage_background(bg_color, width, height):
+    """伪纪录片图片的渐变背景，按底色和尺寸缓存；使用时先 copy()"""
+    rows = []
+    for y in range(height):
+        color_variation = int(y / height * 40)
+        rows.append(tuple(max(0, min(255, c + color_variation)) for c in bg_color))
+    return _vertical_gradient(rows, width)
+
+@lru_cache(maxsize=16)
+def abstract_background(colors, width, height):
+    """抽象图片的多段渐变背景，按配色和尺寸缓存；使用时先 copy()"""
+    rows = []
+    for y in range(height):
+        factor = y / height
+        color_idx = int(factor * (len(colors) - 1))
+        next_idx = min(color_idx + 1, len(colors) - 1)
+        local_factor = (factor * (len(colors) - 1)) - color_idx
+        rows.append(tuple(
+            int(colors[color_idx][c] * (1 - local_factor) + colors[next_idx][c] * local_factor)
+            for c in range(3)
+        ))
+    return _vertical_gradient(rows, width)
+
+def evidence_path(filename):
+    """磁盘上的位置（按文件名分片的两级目录），URL 仍是 /evidence/<filename>"""
+    return evidence_file(filename)
+
+# 多分辨率版本：名称 -> 宽度（full 即原图尺寸）
+IMAGE_VARIANTS = {'thumb': 240, 'medium': 480, 'full': 800}
+
+# 扩展名 -> (MIME, Pillow 格式, 保存参数)，按优先级排列
+VARIANT_FORMATS = {
+    'avif': ('image/avif', 'AVIF', {'quality': 50, 'speed': 8}),
+    'webp': ('image/webp', 'WEBP', {'quality': 60, 'method': 4}),
+    'jpg': ('image/jpeg', 'JPEG', {'quality': 65}),
+}
+
+@lru_cache(maxsize=1)
+def variant_formats():
+    """当前 Pillow 能编码的格式；JPEG 总是可用"""
+    return [ext for ext in VARIANT_FORMATS if ext == 'jpg' or features.check(ext)]
+
+def variant_filename(filename, size, ext):
+    """evidence_x_1.jpg -> evidence_x_1.thumb.webp；full 的 JPEG 就是原文件"""
+    if size == 'full' and ext == 'jpg':
+        return filename
+    return f"{os.path.splitext(filename)[0]}.{size}.{ext}"
+
+def parse_variant_filename(name):
+    """variant_filename 的逆操作，返回 (原文件名, size, ext)；不是变体文件名则返回 None"""
+    parts = name.split('.')
+    if len(parts) >= 3 and parts[-2] in IMAGE_VARIANTS and parts[-1] in VARIANT_FORMATS:
+        return '.'.join(parts[:-2]) + '.jpg', parts[-2], parts[-1]
+    return None
 
-def create_found_footage_image(filename, text, scene_type='dark'):
-    """创建伪纪录片风格图片"""
+def evidence_srcset(file_path):
+    """{MIME: srcset 字符串}，供 <picture><source type=... srcset=...> 使用"""
+    directory, filename = file_path.rsplit('/', 1)
+    return {
+        VARIANT_FORMATS[ext][0]: ', '.join(
+            f"{directory}/{variant_filename(filename, size, ext)} {width}w"
+            for size, width in IMAGE_VARIANTS.items()
+        )
+        for ext in variant_formats()
+    }
+
+def _atomic_save(img, output_path, image_format, **params):
+    """先写临时文件再原子替换，半截的文件不会被当作已渲染的缓存"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    img.save(tmp_path, format=image_format, **params)
+    os.replace(tmp_path, output_path)
+
+def save_variants(img, filename):
+    """写出 thumb / medium / full 各格式的版本（full JPEG 除外，它就是原文件）"""
+    for size, width in IMAGE_VARIANTS.items():
+        resized = img
+        if img.width > width:
+            resized = img.resize((width, round(img.height * width / img.width)), Image.Resampling.LANCZOS)
+        for ext in variant_formats():
+            if size == 'full' and ext == 'jpg':
+                continue
+            _, image_format, params = VARIANT_FORMATS[ext]
+            _atomic_save(resized, evidence_path(variant_filename(filename, size, ext)), image_format, **params)
+
+def make_variants(filename):
+    """为在多分辨率版本之前渲染的图片补上各个版本"""
+    with Image.open(evidence_path(filename)) as img:
+        save_variants(img.convert('RGB'), filename)
+    return filename
+
+def _save_evidence(img, filename, quality, stages=None):
+    """各版本先写，原文件最后写：原文件存在就说明整套已渲染完"""
+    with _stage(stages, 'variants'):
+        save_variants(img, filename)
+    with _stage(stages, 'encode'):
+        output_path = evidence_path(filename)
+        _atomic_save(img, output_path, 'JPEG', quality=quality)
+    return output_path
+
+def create_found_footage_image(filename, text, scene_type='dark', seed=None, size=(800, 600), stages=None):
+    """
+    创建伪纪录片风格图片
+    seed 相同则输出相同（默认随机）；stages 传入 dict 时按阶段累计耗时（见 benchmarks/bench_render.py）
+    """
+    rng = random.Random(seed)
     # 创建图片
-    width, height = 800, 600
+    width, height = size
     
     # 基础色调
     if scene_type == 'dark':
@@ -94,211 +267,232 @@ def create_found_footage_image(filename, text, scene_type='dark'):
         fg_color = (185, 185, 190)
         accent_color = (90, 40, 40)
     
-    img = Image.new('RGB', (width, height), bg_color)
-    draw = ImageDraw.Draw(img)
-    
     # 添加更强的渐变背景效果
-    for y in range(height):
-        gradient_factor = y / height
-        color_variation = int(gradient_factor * 40)
-        current_color = tuple(max(0, min(255, c + color_variation)) for c in bg_color)
-        draw.rectangle([(0, y), (width, y+1)], fill=current_color)
+    with _stage(stages, 'gradient'):
+        img = footage_background(bg_color, width, height).copy()
+        draw = ImageDraw.Draw(img)
     
     # 添加明显的视觉元素 - 矩形和线条（模拟墙壁、门框、窗户等）
-    num_shapes = random.randint(8, 15)
-    for _ in range(num_shapes):
-        shape_type = random.choice(['rect', 'rect', 'line', 'ellipse'])  # 矩形概率更高
-        
-        if shape_type == 'rect':
-            x1, y1 = random.randint(0, width-100), random.randint(0, height-100)
-            w, h = random.randint(100, 300), random.randint(80, 250)
-            # 创建更明显的明暗对比
-            brightness = random.choice([-60, -40, 40, 60])
-            rect_color = tuple(max(0, min(255, c + brightness)) for c in bg_color)
-            draw.rectangle([x1, y1, x1+w, y1+h], fill=rect_color, outline=fg_color, width=2)
-        elif shape_type == 'line':
-            x1, y1 = random.randint(0, width), random.randint(0, height)
-            x2, y2 = random.randint(0, width), random.randint(0, height)
-            line_color = tuple(max(0, min(255, c + random.randint(-30, 30))) for c in fg_color)
-            draw.line([x1, y1, x2, y2], fill=line_color, width=random.randint(3, 8))
-        else:
-            x, y = random.randint(50, width-150), random.randint(50, height-150)
-            w, h = random.randint(60, 150), random.randint(60, 150)
-            brightness = random.choice([-50, -30, 30, 50])
-            ellipse_color = tuple(max(0, min(255, c + brightness)) for c in bg_color)
-            draw.ellipse([x, y, x+w, y+h], fill=ellipse_color, outline=accent_color, width=2)
+    with _stage(stages, 'shapes'):
+        num_shapes = rng.randint(8, 15)
+        for _ in range(num_shapes):
+            shape_type = rng.choice(['rect', 'rect', 'line', 'ellipse'])  # 矩形概率更高
+            
+            if shape_type == 'rect':
+                x1, y1 = rng.randint(0, width-100), rng.randint(0, height-100)
+                w, h = rng.randint(100, 300), rng.randint(80, 250)
+                # 创建更明显的明暗对比
+                brightness = rng.choice([-60, -40, 40, 60])
+                rect_color = tuple(max(0, min(255, c + brightness)) for c in bg_color)
+                draw.rectangle([x1, y1, x1+w, y1+h], fill=rect_color, outline=fg_color, width=2)
+            elif shape_type == 'line':
+                x1, y1 = rng.randint(0, width), rng.randint(0, height)
+                x2, y2 = rng.randint(0, width), rng.randint(0, height)
+                line_color = tuple(max(0, min(255, c + rng.randint(-30, 30))) for c in fg_color)
+                draw.line([x1, y1, x2, y2], fill=line_color, width=rng.randint(3, 8))
+            else:
+                x, y = rng.randint(50, width-150), rng.randint(50, height-150)
+                w, h = rng.randint(60, 150), rng.randint(60, 150)
+                brightness = rng.choice([-50, -30, 30, 50])
+                ellipse_color = tuple(max(0, min(255, c + brightness)) for c in bg_color)
+                draw.ellipse([x, y, x+w, y+h], fill=ellipse_color, outline=accent_color, width=2)
     
     # 添加一些"抓痕"或"裂纹"效果
-    for _ in range(random.randint(3, 7)):
-        x_start = random.randint(0, width)
-        y_start = random.randint(0, height)
-        for i in range(random.randint(5, 15)):
-            x_end = x_start + random.randint(-30, 30)
-            y_end = y_start + random.randint(10, 40)
-            draw.line([x_start, y_start, x_end, y_end], fill=accent_color, width=random.randint(1, 3))
-            x_start, y_start = x_end, y_end
+    with _stage(stages, 'scratches'):
+        for _ in range(rng.randint(3, 7)):
+            x_start = rng.randint(0, width)
+            y_start = rng.randint(0, height)
+            for i in range(rng.randint(5, 15)):
+                x_end = x_start + rng.randint(-30, 30)
+                y_end = y_start + rng.randint(10, 40)
+                draw.line([x_start, y_start, x_end, y_end], fill=accent_color, width=rng.randint(1, 3))
+                x_start, y_start = x_end, y_end
     
     # 添加拼贴风格元素
     # 1. 胶带痕迹
-    if random.random() > 0.3:
-        tape_angle = random.choice([-15, -10, 10, 15])
-        tape_x = random.randint(width//4, width*3//4)
-        tape_y = random.choice([20, height-40])
-        tape_width = random.randint(80, 150)
-        # 半透明黄色胶带
-        tape_color = (200, 200, 150, 150)
-        draw.rectangle([tape_x, tape_y, tape_x+tape_width, tape_y+20], 
-                      fill=(220, 220, 180), outline=(180, 180, 140), width=2)
-    
-    # 2. 标记/圆圈
-    if random.random() > 0.4:
-        warning_x = random.randint(width//4, width*3//4)
-        warning_y = random.randint(height//4, height*3//4)
-        warning_size = random.randint(60, 120)
-        # 红色圆圈标记
-        for i in range(3):
-            draw.ellipse([warning_x-warning_size-i*2, warning_y-warning_size-i*2, 
-                         warning_x+warning_size+i*2, warning_y+warning_size+i*2], 
-                        outline=(180, 20, 20), width=3)
-    
-    # 3. 箭头标记
-    if random.random() > 0.5:
-        arrow_x = random.randint(50, width-100)
-        arrow_y = random.randint(50, height-100)
-        # 简单箭头
-        draw.line([arrow_x, arrow_y, arrow_x+40, arrow_y], fill=(180, 20, 20), width=4)
-        draw.line([arrow_x+40, arrow_y, arrow_x+30, arrow_y-10], fill=(180, 20, 20), width=4)
-        draw.line([arrow_x+40, arrow_y, arrow_x+30, arrow_y+10], fill=(180, 20, 20), width=4)
-    
-    # 4. "证据"印章
-    if random.random() > 0.6:
-        stamp_x = random.choice([30, width-120])
-        stamp_y = random.choice([30, height-120])
-        stamp_texts = ['EVIDENCE', '证据', 'CLASSIFIED', '机密', 'TOP SECRET']
-        stamp_text = random.choice(stamp_texts)
-        try:
-            stamp_font = ImageFont.truetype("msyh.ttc", 24)
-        except:
-            stamp_font = small_font
-        # 旋转印章效果
-        draw.text((stamp_x, stamp_y), stamp_text, fill=(150, 20, 20), font=stamp_font)
+    with _stage(stages, 'collage'):
+        if rng.random() > 0.3:
+            tape_angle = rng.choice([-15, -10, 10, 15])
+            tape_x = rng.randint(width//4, width*3//4)
+            tape_y = rng.choice([20, height-40])
+            tape_width = rng.randint(80, 150)
+            # 半透明黄色胶带
+            tape_color = (200, 200, 150, 150)
+            draw.rectangle([tape_x, tape_y, tape_x+tape_width, tape_y+20], 
+                          fill=(220, 220, 180), outline=(180, 180, 140), width=2)
+        
+        # 2. 标记/圆圈
+        if rng.random() > 0.4:
+            warning_x = rng.randint(width//4, width*3//4)
+            warning_y = rng.randint(height//4, height*3//4)
+            warning_size = rng.randint(60, 120)
+            # 红色圆圈标记
+            for i in range(3):
+                draw.ellipse([warning_x-warning_size-i*2, warning_y-warning_size-i*2, 
+                             warning_x+warning_size+i*2, warning_y+warning_size+i*2], 
+                            outline=(180, 20, 20), width=3)
+        
+        # 3. 箭头标记
+        if rng.random() > 0.5:
+            arrow_x = rng.randint(50, width-100)
+            arrow_y = rng.randint(50, height-100)
+            # 简单箭头
+            draw.line([arrow_x, arrow_y, arrow_x+40, arrow_y], fill=(180, 20, 20), width=4)
+            draw.line([arrow_x+40, arrow_y, arrow_x+30, arrow_y-10], fill=(180, 20, 20), width=4)
+            draw.line([arrow_x+40, arrow_y, arrow_x+30, arrow_y+10], fill=(180, 20, 20), width=4)
+        
+        # 4. "证据"印章
+        if rng.random() > 0.6:
+            stamp_x = rng.choice([30, width-120])
+            stamp_y = rng.choice([30, height-120])
+            stamp_texts = ['EVIDENCE', '证据', 'CLASSIFIED', '机密', 'TOP SECRET']
+            stamp_text = rng.choice(stamp_texts)
+            try:
+                stamp_font = ImageFont.truetype("msyh.ttc", 24)
+            except:
+                stamp_font = ImageFont.load_default()
+            # 旋转印章效果
+            draw.text((stamp_x, stamp_y), stamp_text, fill=(150, 20, 20), font=stamp_font)
     
     # 添加文字（模拟拍摄对象）
-    try:
-        # 尝试使用系统字体
-        font = ImageFont.truetype("msyh.ttc", 48)  # 增大字体
-        small_font = ImageFont.truetype("msyh.ttc", 28)
-        tiny_font = ImageFont.truetype("msyh.ttc", 20)
-    except:
-        font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
-        tiny_font = ImageFont.load_default()
-    
-    # 主要文字 - 添加背景框
-    text_bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
-    text_x = (width - text_width) // 2
-    text_y = (height - text_height) // 2
-    
-    # 文字背景半透明框
-    padding = 20
-    draw.rectangle([text_x - padding, text_y - padding, 
-                   text_x + text_width + padding, text_y + text_height + padding],
-                  fill=(0, 0, 0), outline=accent_color, width=3)
-    
-    # 添加文字多重阴影（增强可见度）
-    for offset in [(3, 3), (2, 2), (1, 1)]:
-        draw.text((text_x + offset[0], text_y + offset[1]), text, fill=(0, 0, 0), font=font)
-    draw.text((text_x, text_y), text, fill=(255, 255, 255), font=font)  # 纯白色主文字
-    
-    # 添加时间戳（手机拍摄特征）- 左下角带背景
-    timestamp = f"2025/11/{random.randint(1,8):02d} {random.randint(0,23):02d}:{random.randint(0,59):02d}"
-    time_bbox = draw.textbbox((0, 0), timestamp, font=small_font)
-    time_w = time_bbox[2] - time_bbox[0]
-    time_h = time_bbox[3] - time_bbox[1]
-    draw.rectangle([10, height-50, 20+time_w, height-10], fill=(0, 0, 0, 180))
-    draw.text((15, height - 45), timestamp, fill=(255, 200, 0), font=small_font)
-    
-    # 添加手机型号水印 - 右下角
-    phones = ["iPhone 12", "iPhone 13", "Samsung Galaxy", "HUAWEI", "Xiaomi"]
-    phone_model = random.choice(phones)
-    phone_bbox = draw.textbbox((0, 0), phone_model, font=tiny_font)
-    phone_w = phone_bbox[2] - phone_bbox[0]
-    draw.rectangle([width-phone_w-20, height-35, width-5, height-5], fill=(0, 0, 0, 180))
-    draw.text((width - phone_w - 15, height - 30), phone_model, fill=(180, 180, 180), font=tiny_font)
-    
-    # 添加"拍摄质量指示器"
-    quality_text = random.choice(["低光模式", "夜间模式", "HDR关闭", "闪光灯强制", "手动对焦"])
-    draw.text((15, 15), quality_text, fill=(200, 200, 0), font=tiny_font)
+    with _stage(stages, 'text'):
+        try:
+            # 尝试使用系统字体
+            font = ImageFont.truetype("msyh.ttc", 48)  # 增大字体
+            small_font = ImageFont.truetype("msyh.ttc", 28)
+            tiny_font = ImageFont.truetype("msyh.ttc", 20)
+        except:
+            font = ImageFont.load_default()
+            small_font = ImageFont.load_default()
+            tiny_font = ImageFont.load_default()
+        
+        # 主要文字 - 添加背景框
+        text_bbox = draw.textbbox((0, 0), text, font=font)
+        text_width = text_bbox[2] - text_bbox[0]
+        text_height = text_bbox[3] - text_bbox[1]
+        text_x = (width - text_width) // 2
+        text_y = (height - text_height) // 2
+        
+        # 文字背景半透明框
+        padding = 20
+        draw.rectangle([text_x - padding, text_y - padding, 
+                       text_x + text_width + padding, text_y + text_height + padding],
+                      fill=(0, 0, 0), outline=accent_color, width=3)
+        
+        # 添加文字多重阴影（增强可见度）
+        for offset in [(3, 3), (2, 2), (1, 1)]:
+            draw.text((text_x + offset[0], text_y + offset[1]), text, fill=(0, 0, 0), font=font)
+        draw.text((text_x, text_y), text, fill=(255, 255, 255), font=font)  # 纯白色主文字
+        
+        # 添加时间戳（手机拍摄特征）- 左下角带背景
+        timestamp = f"2025/11/{rng.randint(1,8):02d} {rng.randint(0,23):02d}:{rng.randint(0,59):02d}"
+        time_bbox = draw.textbbox((0, 0), timestamp, font=small_font)
+        time_w = time_bbox[2] - time_bbox[0]
+        time_h = time_bbox[3] - time_bbox[1]
+        draw.rectangle([10, height-50, 20+time_w, height-10], fill=(0, 0, 0, 180))
+        draw.text((15, height - 45), timestamp, fill=(255, 200, 0), font=small_font)
+        
+        # 添加手机型号水印 - 右下角
+        phones = ["iPhone 12", "iPhone 13", "Samsung Galaxy", "HUAWEI", "Xiaomi"]
+        phone_model = rng.choice(phones)
+        phone_bbox = draw.textbbox((0, 0), phone_model, font=tiny_font)
+        phone_w = phone_bbox[2] - phone_bbox[0]
+        draw.rectangle([width-phone_w-20, height-35, width-5, height-5], fill=(0, 0, 0, 180))
+        draw.text((width - phone_w - 15, height - 30), phone_model, fill=(180, 180, 180), font=tiny_font)
+        
+        # 添加"拍摄质量指示器"
+        quality_text = rng.choice(["低光模式", "夜间模式", "HDR关闭", "闪光灯强制", "手动对焦"])
+        draw.text((15, 15), quality_text, fill=(200, 200, 0), font=tiny_font)
     
     # 应用强烈的Brutalism效果
     # 1. 先转为灰度（黑白效果）
-    img = img.convert('L')
-    
-    # 2. 增强对比度（类似高对比度复印）
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(2.5)
-    
-    # 3. 调整亮度
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(0.85)
+    with _stage(stages, 'tone'):
+        img = img.convert('L')
+        
+        # 2. 增强对比度（类似高对比度复印）
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(2.5)
+        
+        # 3. 调整亮度
+        enhancer = ImageEnhance.Brightness(img)
+        img = enhancer.enhance(0.85)
     
     # 4. 应用半色调/网点效果（Halftone）
-    img = apply_halftone_effect(img)
+    with _stage(stages, 'halftone'):
+        img = apply_halftone_effect(img)
     
     # 转回RGB用于后续处理
-    img = img.convert('RGB')
-    
-    # 5. 添加扫描线效果（强化版）
-    draw = ImageDraw.Draw(img)
-    for y in range(0, height, 3):
-        draw.line([(0, y), (width, y)], fill=(0, 0, 0), width=1)
-    
-    # 6. 添加垂直扫描线（模拟CRT显示器）
-    if random.random() > 0.5:
-        for x in range(0, width, random.randint(4, 8)):
-            draw.line([(x, 0), (x, height)], fill=(20, 20, 20), width=1)
+    with _stage(stages, 'scanlines'):
+        img = img.convert('RGB')
+        
+        # 5. 添加扫描线效果（强化版）
+        draw = ImageDraw.Draw(img)
+        for y in range(0, height, 3):
+            draw.line([(0, y), (width, y)], fill=(0, 0, 0), width=1)
+        
+        # 6. 添加垂直扫描线（模拟CRT显示器）
+        if rng.random() > 0.5:
+            for x in range(0, width, rng.randint(4, 8)):
+                draw.line([(x, 0), (x, height)], fill=(20, 20, 20), width=1)
     
     # 7. 添加强噪点
-    img = add_noise(img, intensity=0.35)
+    with _stage(stages, 'noise'):
+        img = add_noise(img, intensity=0.35, rng=rng.getrandbits(64))
     
     # 8. 添加暗角
-    img = add_vignette(img)
+    with _stage(stages, 'vignette'):
+        img = add_vignette(img)
     
     # 保存
-    output_path = os.path.join('static', 'evidence', filename)
-    img.save(output_path, quality=65)  # 低质量，模拟压缩
+    output_path = _save_evidence(img, filename, quality=65, stages=stages)  # 低质量，模拟压缩
     print(f"✅ 生成: {output_path}")
 
+# 初始数据用到的占位图片
+PLACEHOLDER_IMAGES = [
+    ('fish_tank_night.jpg', '诡异的鱼缸', 'dark'),
+    ('wall_scratch.jpg', '墙上抓痕', 'indoor'),
+    ('old_note.jpg', '神秘纸条', 'indoor'),
+    ('theater_last_row.jpg', '最后一排座位', 'dark'),
+    ('theater_demolition.jpg', '拆除现场', 'outdoor'),
+    ('minibus_interior.jpg', '红色小巴内部', 'dark'),
+    ('gps_location.jpg', 'GPS异常定位', 'indoor'),
+    ('pier_distance.jpg', '废弃码头', 'outdoor'),
+    ('newspaper_1987.jpg', '1987年旧报纸', 'indoor'),
+]
+
+def placeholder_recipe(filename):
+    """占位图片的渲染配方（与 Evidence.render_recipe 格式相同），不是占位图片则返回 None"""
+    for name, text, scene_type in PLACEHOLDER_IMAGES:
+        if name == filename:
+            return {'kind': 'found_footage', 'args': [text, scene_type, filename]}
+    return None
+
 # 生成所有占位图片
 def generate_all_images():
     print("🎬 开始生成伪纪录片风格图片...")
     
-    images = [
-        ('fish_tank_night.jpg', '诡异的鱼缸', 'dark'),
-        ('wall_scratch.jpg', '墙上抓痕', 'indoor'),
-        ('old_note.jpg', '神秘纸条', 'indoor'),
-        ('theater_last_row.jpg', '最后一排座位', 'dark'),
-        ('theater_demolition.jpg', '拆除现场', 'outdoor'),
-        ('minibus_interior.jpg', '红色小巴内部', 'dark'),
-        ('gps_location.jpg', 'GPS异常定位', 'indoor'),
-        ('pier_distance.jpg', '废弃码头', 'outdoor'),
-        ('newspaper_1987.jpg', '1987年旧报纸', 'indoor'),
-    ]
-    
-    for filename, text, scene_type in images:
-        create_found_footage_image(filename, text, scene_type)
-    
-    print(f"\n✅ 所有图片生成完成！共 {len(images)} 张")
+    for filename, text, scene_type in PLACEHOLDER_IMAGES:
+        create_found_footage_image(filename, text, scene_type, seed=filename)
+    
+    print(f"\n✅ 所有图片生成完成！共 {len(PLACEHOLDER_IMAGES)} 张")
 
-def generate_story_evidence_images(story_title, story_content, story_category, num_images=3):
+def story_evidence_key(story_title, story_content, story_category, variant=''):
     """
-    根据故事内容生成相关的证据图片
-    返回生成的图片文件名列表
+    故事证据的内容键：同一故事（同一类别、同一 variant，如状态名）在同一渲染器版本下总是得到同样的文件名和随机种子。
+    各字段按 JSON 数组编码，不同的 (标题, 正文) 拆分不会拼出同一个键；RENDER_VERSION 变了就换新文件名
+    """
+    payload = json.dumps([story_title, story_content, story_category, variant, RENDER_VERSION], ensure_ascii=False)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+def plan_story_evidence_images(story_title, story_content, story_category, num_images=3, variant=''):
+    """
+    为故事挑选每张证据图片的文字、场景和种子，不渲染
+    返回 [(filename, text, scene_type, seed)]，交给 create_found_footage_image 或渲染进程池；
+    结果只取决于故事内容、类别、variant 和渲染器版本
     """
     # 根据故事内容生成唯一的文件名
-    story_hash = hashlib.md5((story_title + story_content).encode()).hexdigest()[:8]
+    story_hash = story_evidence_key(story_title, story_content, story_category, variant)[:16]
+    rng = random.Random(story_hash)
     
     # 根据类别和内容关键词选择场景类型和文字
     category_themes = {
@@ -339,46 +533,45 @@ def generate_story_evidence_images(story_title, story_content, story_category, n
     # 从故事内容中提取关键词来生成更相关的文字
     keywords = extract_keywords_from_story(story_content)
     
-    generated_files = []
+    plan = []
     
     for i in range(min(num_images, 5)):  # 最多5张
         # 随机选择主题或使用关键词
-        if keywords and random.random() > 0.3:
-            text = random.choice(keywords)
-            scene_type = random.choice(['dark', 'indoor', 'outdoor'])
+        if keywords and rng.random() > 0.3:
+            text = rng.choice(keywords)
+            scene_type = rng.choice(['dark', 'indoor', 'outdoor'])
         else:
-            text, scene_type = random.choice(themes)
+            text, scene_type = rng.choice(themes)
         
         filename = f"evidence_{story_hash}_{i+1}.jpg"
-        create_found_footage_image(filename, text, scene_type)
-        generated_files.append(filename)
+        plan.append((filename, text, scene_type, f"{story_hash}_{i+1}"))
     
-    return generated_files
+    return plan
+
+# 常见的恐怖/灵异关键词
+STORY_KEYWORDS = [
+    '鱼缸', '墙壁', '座位', '戏院', '小巴', '码头', 
+    '纸条', '照片', '录像', '监控', '手机', '镜子',
+    '房间', '走廊', '楼梯', '地下室', '天台', '电梯',
+    '抓痕', '血迹', '脚印', '影子', '雾气', '窗户',
+    '门', '钟声', '脚步声', '呼吸', '眼睛', '手印'
+]
+STORY_KEYWORD_MATCHER = KeywordMatcher(STORY_KEYWORDS)
 
 def extract_keywords_from_story(content):
-    """从故事内容中提取可用作图片主题的关键词"""
-    keywords = []
-    
-    # 常见的恐怖/灵异关键词
-    keyword_patterns = [
-        '鱼缸', '墙壁', '座位', '戏院', '小巴', '码头', 
-        '纸条', '照片', '录像', '监控', '手机', '镜子',
-        '房间', '走廊', '楼梯', '地下室', '天台', '电梯',
-        '抓痕', '血迹', '脚印', '影子', '雾气', '窗户',
-        '门', '钟声', '脚步声', '呼吸', '眼睛', '手印'
-    ]
-    
-    for keyword in keyword_patterns:
-        if keyword in content:
-            keywords.append(keyword)
+    """从故事内容中提取可用作图片主题的关键词（按 STORY_KEYWORDS 的顺序）"""
+    found = STORY_KEYWORD_MATCHER.found(content)
+    keywords = [keyword for keyword in STORY_KEYWORDS if keyword in found]
     
     return keywords[:10]  # 最多返回10个关键词
 
-def create_abstract_image(filename, color_scheme='dark'):
+def create_abstract_image(filename, color_scheme='dark', seed=None, size=(800, 600), stages=None):
     """
     创建抽象恐怖风格图片 - 加强版
+    seed 相同则输出相同（默认随机）；stages 同 create_found_footage_image
     """
-    width, height = 800, 600
+    rng = random.Random(seed)
+    width, height = size
     
     # 颜色方案 - 增强对比度
     color_schemes = {
@@ -390,79 +583,74 @@ def create_abstract_image(filename, color_scheme='dark'):
     
     colors = color_schemes.get(color_scheme, color_schemes['dark'])
     
-    img = Image.new('RGB', (width, height), colors[0])
-    draw = ImageDraw.Draw(img)
-    
     # 添加渐变背景
-    for y in range(height):
-        factor = y / height
-        color_idx = int(factor * (len(colors) - 1))
-        next_idx = min(color_idx + 1, len(colors) - 1)
-        local_factor = (factor * (len(colors) - 1)) - color_idx
-        
-        r = int(colors[color_idx][0] * (1 - local_factor) + colors[next_idx][0] * local_factor)
-        g = int(colors[color_idx][1] * (1 - local_factor) + colors[next_idx][1] * local_factor)
-        b = int(colors[color_idx][2] * (1 - local_factor) + colors[next_idx][2] * local_factor)
-        
-        draw.line([(0, y), (width, y)], fill=(r, g, b))
+    with _stage(stages, 'gradient'):
+        img = abstract_background(tuple(colors), width, height).copy()
+        draw = ImageDraw.Draw(img)
     
     # 创建大量明显的图案元素
-    for _ in range(random.randint(25, 40)):
-        shape_type = random.choice(['ellipse', 'rectangle', 'line', 'polygon'])
-        color = random.choice(colors)
-        
-        if shape_type == 'ellipse':
-            x1, y1 = random.randint(-100, width), random.randint(-100, height)
-            x2, y2 = x1 + random.randint(80, 400), y1 + random.randint(80, 400)
-            # 添加轮廓增强可见度
-            draw.ellipse([x1, y1, x2, y2], fill=color, outline=colors[-1], width=3)
-        elif shape_type == 'rectangle':
-            x1, y1 = random.randint(-50, width), random.randint(-50, height)
-            x2, y2 = x1 + random.randint(100, 350), y1 + random.randint(100, 350)
-            draw.rectangle([x1, y1, x2, y2], fill=color, outline=colors[-1], width=4)
-        elif shape_type == 'polygon':
-            points = [(random.randint(0, width), random.randint(0, height)) 
-                     for _ in range(random.randint(3, 6))]
-            draw.polygon(points, fill=color, outline=colors[-1])
-        else:
-            x1, y1 = random.randint(0, width), random.randint(0, height)
-            x2, y2 = random.randint(0, width), random.randint(0, height)
-            draw.line([x1, y1, x2, y2], fill=colors[-1], width=random.randint(5, 15))
+    with _stage(stages, 'shapes'):
+        for _ in range(rng.randint(25, 40)):
+            shape_type = rng.choice(['ellipse', 'rectangle', 'line', 'polygon'])
+            color = rng.choice(colors)
+            
+            if shape_type == 'ellipse':
+                x1, y1 = rng.randint(-100, width), rng.randint(-100, height)
+                x2, y2 = x1 + rng.randint(80, 400), y1 + rng.randint(80, 400)
+                # 添加轮廓增强可见度
+                draw.ellipse([x1, y1, x2, y2], fill=color, outline=colors[-1], width=3)
+            elif shape_type == 'rectangle':
+                x1, y1 = rng.randint(-50, width), rng.randint(-50, height)
+                x2, y2 = x1 + rng.randint(100, 350), y1 + rng.randint(100, 350)
+                draw.rectangle([x1, y1, x2, y2], fill=color, outline=colors[-1], width=4)
+            elif shape_type == 'polygon':
+                points = [(rng.randint(0, width), rng.randint(0, height)) 
+                         for _ in range(rng.randint(3, 6))]
+                draw.polygon(points, fill=color, outline=colors[-1])
+            else:
+                x1, y1 = rng.randint(0, width), rng.randint(0, height)
+                x2, y2 = rng.randint(0, width), rng.randint(0, height)
+                draw.line([x1, y1, x2, y2], fill=colors[-1], width=rng.randint(5, 15))
     
     # 添加"扭曲"效果 - 随机曲线
-    for _ in range(random.randint(10, 20)):
-        points = []
-        x_start = random.randint(0, width)
-        y_start = random.randint(0, height)
-        for i in range(random.randint(5, 10)):
-            x_start += random.randint(-50, 50)
-            y_start += random.randint(-50, 50)
-            points.append((x_start, y_start))
-        if len(points) > 1:
-            draw.line(points, fill=colors[-1], width=random.randint(2, 6))
+    with _stage(stages, 'curves'):
+        for _ in range(rng.randint(10, 20)):
+            points = []
+            x_start = rng.randint(0, width)
+            y_start = rng.randint(0, height)
+            for i in range(rng.randint(5, 10)):
+                x_start += rng.randint(-50, 50)
+                y_start += rng.randint(-50, 50)
+                points.append((x_start, y_start))
+            if len(points) > 1:
+                draw.line(points, fill=colors[-1], width=rng.randint(2, 6))
     
     # 添加"噪音纹理"
-    for _ in range(random.randint(50, 100)):
-        x, y = random.randint(0, width), random.randint(0, height)
-        size = random.randint(2, 8)
-        noise_color = random.choice(colors)
-        draw.ellipse([x, y, x+size, y+size], fill=noise_color)
+    with _stage(stages, 'texture'):
+        for _ in range(rng.randint(50, 100)):
+            x, y = rng.randint(0, width), rng.randint(0, height)
+            dot_size = rng.randint(2, 8)
+            noise_color = rng.choice(colors)
+            draw.ellipse([x, y, x+dot_size, y+dot_size], fill=noise_color)
     
     # 应用效果
-    img = img.filter(ImageFilter.GaussianBlur(radius=random.uniform(2, 5)))
-    img = add_noise(img, intensity=0.3)
+    with _stage(stages, 'blur'):
+        img = img.filter(ImageFilter.GaussianBlur(radius=rng.uniform(2, 5)))
+    with _stage(stages, 'noise'):
+        img = add_noise(img, intensity=0.3, rng=rng.getrandbits(64))
     
     # 降低亮度
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(0.6)
+    with _stage(stages, 'brightness'):
+        enhancer = ImageEnhance.Brightness(img)
+        img = enhancer.enhance(0.6)
     
     # 添加扫描线效果
-    for y in range(0, height, 4):
-        draw.line([(0, y), (width, y)], fill=(0, 0, 0), width=1)
+    with _stage(stages, 'scanlines'):
+        for y in range(0, height, 4):
+            draw.line([(0, y), (width, y)], fill=(0, 0, 0), width=1)
     
     # 保存
-    output_path = os.path.join('static', 'evidence', filename)
-    img.save(output_path, quality=60)
+    output_path = _save_evidence(img, filename, quality=60, stages=stages)
     print(f"✅ 生成抽象图片: {output_path}")
     return filename
 
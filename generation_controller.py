@@ -0,0 +1,183 @@
+"""
+故事生成速率控制器 - 根据评论/浏览速率、AI 回复队列深度和模型延迟调整生成间隔；
+队列深度和延迟是每个 worker 进程内的数据，由各 worker 的调度宿主定期写入 worker_load 表，leader 汇总所有 worker
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+
+AI_REPLY_QUEUE = metrics.gauge('ai_reply_queue_depth', 'AI replies waiting to be generated')
+AI_PROVIDER_LATENCY = metrics.histogram('ai_provider_latency_seconds', 'AI provider call latency')
+GENERATION_INTERVAL = metrics.gauge('story_generation_interval_minutes', 'Current story generation interval')
+GENERATION_SIGNAL = metrics.gauge('story_generation_signal', 'Inputs of the last generation rate decision')
+GENERATION_DECISIONS = metrics.counter('story_generation_decisions_total', 'Generation rate decisions by reason')
+
+# Weight of a story view relative to a comment when measuring engagement
+VIEW_WEIGHT = 0.1
+
+_latency_lock = threading.Lock()
+_latency_ewma = None
+
+
+def record_provider_latency(seconds):
+    """Record the duration of one AI provider call"""
+    global _latency_ewma
+    AI_PROVIDER_LATENCY.observe(seconds)
+    with _latency_lock:
+        _latency_ewma = seconds if _latency_ewma is None else 0.8 * _latency_ewma + 0.2 * seconds
+
+
+def provider_latency():
+    with _latency_lock:
+        return _latency_ewma or 0.0
+
+
+def publish_load(worker, prune_after_seconds=3600):
+    """
+    Store this process's reply backlog and provider latency as worker's worker_load row (in an app
+    context), and drop rows of workers that stopped reporting more than prune_after_seconds ago
+    """
+    from app import db, WorkerLoad
+    from sqlalchemy.exc import IntegrityError
+
+    now = datetime.utcnow()
+    values = {
+        'reply_queue_depth': int(AI_REPLY_QUEUE.get()),
+        'provider_latency_seconds': provider_latency(),
+        'updated_at': now
+    }
+    updated = db.session.execute(
+        db.update(WorkerLoad)
+        .where(WorkerLoad.worker == worker)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        db.session.add(WorkerLoad(worker=worker, **values))
+    db.session.execute(
+        db.delete(WorkerLoad)
+        .where(WorkerLoad.updated_at < now - timedelta(seconds=prune_after_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # row created concurrently under the same name; next report updates it
+
+
+def withdraw_load(worker):
+    """Remove worker's row when it shuts down cleanly (in an app context)"""
+    from app import db, WorkerLoad
+
+    db.session.execute(
+        db.delete(WorkerLoad)
+        .where(WorkerLoad.worker == worker)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+class GenerationController:
+    """Multiplicative back-off / speed-up of the generation interval, clamped to configured bounds"""
+
+    def __init__(self):
+        self.base_minutes = float(os.getenv('STORY_GEN_INTERVAL_MINUTES', 5))
+        self.min_minutes = float(os.getenv('STORY_GEN_MIN_INTERVAL_MINUTES', 1))
+        self.max_minutes = float(os.getenv('STORY_GEN_MAX_INTERVAL_MINUTES', 60))
+        self.queue_high = int(os.getenv('GEN_QUEUE_HIGH', 20))
+        self.latency_high = float(os.getenv('GEN_LATENCY_HIGH_SECONDS', 20))
+        self.engagement_high = float(os.getenv('GEN_ENGAGEMENT_HIGH', 30))
+        self.engagement_low = float(os.getenv('GEN_ENGAGEMENT_LOW', 2))
+        self.window_minutes = int(os.getenv('GEN_ENGAGEMENT_WINDOW_MINUTES', 30))
+        # Scheduler hosts report every third of a lease; three missed reports mean the worker is gone
+        self.load_stale_seconds = int(os.getenv('SCHEDULER_LEASE_SECONDS', 30))
+        self.interval_minutes = self.base_minutes
+        self._last_views = None
+        self._last_views_at = None
+        GENERATION_INTERVAL.set(self.interval_minutes)
+
+    def resume(self, interval_minutes):
+        """Continue from the interval a previous scheduler leader chose (kept in the job store)"""
+        self.interval_minutes = min(self.max_minutes, max(self.min_minutes, interval_minutes))
+        GENERATION_INTERVAL.set(self.interval_minutes)
+
+    def collect_signals(self):
+        """
+        Comment/view rates plus the reply backlog summed over all workers and the highest provider
+        latency any of them reports, all from the database
+        """
+        from app import db, Comment, Story, WorkerLoad
+
+        since = datetime.utcnow() - timedelta(minutes=self.window_minutes)
+        comments = db.session.query(db.func.count(Comment.id)).filter(
+            Comment.is_ai_response.is_(False),
+            Comment.created_at >= since
+        ).scalar() or 0
+        comments_per_hour = comments * 60.0 / self.window_minutes
+
+        # Story.views is cumulative, so the view rate is the delta since the last decision
+        total_views = db.session.query(db.func.coalesce(db.func.sum(Story.views), 0)).scalar()
+        now = time.monotonic()
+        views_per_hour = 0.0
+        if self._last_views is not None and now > self._last_views_at:
+            views_per_hour = max(0, total_views - self._last_views) * 3600.0 / (now - self._last_views_at)
+        self._last_views, self._last_views_at = total_views, now
+
+        reported_since = datetime.utcnow() - timedelta(seconds=self.load_stale_seconds)
+        queue_depth, latency = db.session.query(
+            db.func.sum(WorkerLoad.reply_queue_depth),
+            db.func.max(WorkerLoad.provider_latency_seconds)
+        ).filter(WorkerLoad.updated_at >= reported_since).one()
+        if queue_depth is None:
+            # No worker has reported yet (e.g. right after the first leader starts)
+            queue_depth, latency = AI_REPLY_QUEUE.get(), provider_latency()
+
+        return {
+            'comments_per_hour': comments_per_hour,
+            'views_per_hour': views_per_hour,
+            'reply_queue_depth': queue_depth,
+            'provider_latency_seconds': latency or 0.0
+        }
+
+    def decide(self, signals):
+        """Return (new interval in minutes, reason)"""
+        engagement = signals['comments_per_hour'] + signals['views_per_hour'] * VIEW_WEIGHT
+        interval = self.interval_minutes
+
+        if signals['reply_queue_depth'] >= self.queue_high or \
+           signals['provider_latency_seconds'] >= self.latency_high:
+            interval, reason = interval * 2, 'saturated'
+        elif engagement >= self.engagement_high:
+            interval, reason = interval / 2, 'engaged'
+        elif engagement <= self.engagement_low:
+            interval, reason = interval * 1.5, 'idle'
+        else:
+            interval, reason = interval + (self.base_minutes - interval) / 2, 'steady'
+
+        return min(self.max_minutes, max(self.min_minutes, interval)), reason
+
+    def update(self):
+        """Collect signals, pick the next interval and record the decision; returns the interval"""
+        signals = self.collect_signals()
+        interval, reason = self.decide(signals)
+        self.interval_minutes = interval
+
+        for name, value in signals.items():
+            GENERATION_SIGNAL.set(value, signal=name)
+        GENERATION_INTERVAL.set(interval)
+        GENERATION_DECISIONS.inc(reason=reason)
+        print(f"🎛️  Story generation interval -> {interval:.1f} min ({reason})")
+        return interval
+
+
+_controller = None
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        _controller = GenerationController()
+    return _controller
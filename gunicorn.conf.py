@@ -0,0 +1,20 @@
+"""
+gunicorn 配置（gunicorn 会自动读取当前目录下的这个文件）- 调度宿主只在服务器 worker 里启动，
+导入 app 的 CLI 工具（seed.py、render_evidence.py、flask init-db）不会启动它
+"""
+import os
+
+
+def post_worker_init(worker):
+    """With SCHEDULER_ENABLED=true every worker runs a scheduler host; the database lease elects the leader"""
+    # Read after the app was loaded, so a SCHEDULER_ENABLED from .env counts too
+    if os.getenv('SCHEDULER_ENABLED', 'false').lower() != 'true':
+        return
+    from scheduler_tasks import start_scheduler
+    start_scheduler(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    """Release the lease on a clean exit so another worker takes over without waiting for it to expire"""
+    from scheduler_tasks import stop_scheduler
+    stop_scheduler()
@@ -0,0 +1,80 @@
+"""
+多关键词匹配 - 关键词表在导入时编译成一个正则，供故事关键词提取和回复过滤共用；
+一遍扫描返回是否命中、命中的关键词集合，或所有命中（含重叠）的位置和次数
+"""
+import re
+from collections import namedtuple
+
+# start/end are offsets into the scanned text (end exclusive)
+Match = namedtuple('Match', ['start', 'end', 'keyword'])
+
+
+def _overlap_free(keywords):
+    """True if no keyword can start inside another one's match (contained in it, or prefixed by its suffix)"""
+    for keyword in keywords:
+        for other in keywords:
+            if other == keyword:
+                continue
+            if other in keyword[1:] or any(keyword.endswith(other[:i]) for i in range(1, len(other))):
+                return False
+    return True
+
+
+class KeywordMatcher:
+    """
+    A fixed keyword set compiled into one alternation, longest keyword first, so the regex engine
+    scans the text once in C instead of once per keyword (see benchmarks/bench_keyword_matcher.py).
+    Only on long texts dense with keywords do separate `in` scans win, since each stops at its first hit.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(k for k in keywords if k))
+        self._pattern = re.compile('|'.join(map(re.escape, sorted(self.keywords, key=len, reverse=True))))
+        # Keywords that also match at the start of a match of this one, shortest first
+        self._prefixes = {k: tuple(sorted((o for o in self.keywords if k.startswith(o)), key=len))
+                          for k in self.keywords}
+        # Then consecutive non-overlapping matches already are every hit
+        self._overlap_free = _overlap_free(self.keywords) and all(len(p) == 1 for p in self._prefixes.values())
+
+    def contains_any(self, text):
+        return bool(self.keywords) and self._pattern.search(text) is not None
+
+    def found(self, text):
+        """Set of keywords that occur in text"""
+        if not self.keywords:
+            return set()
+        if self._overlap_free:
+            return set(self._pattern.findall(text))
+        return {match.keyword for match in self.find_all(text)}
+
+    def find_all(self, text):
+        """Every occurrence of every keyword (overlapping ones included) as Matches sorted by position"""
+        if not self.keywords:
+            return []
+        if self._overlap_free:
+            return [Match(m.start(), m.end(), m.group()) for m in self._pattern.finditer(text)]
+
+        # Resume one character after each match start, so hits starting inside it are found too
+        matches = []
+        search = self._pattern.search
+        m = search(text)
+        while m is not None:
+            start = m.start()
+            for keyword in self._prefixes[m.group()]:
+                matches.append(Match(start, start + len(keyword), keyword))
+            m = search(text, start + 1)
+        return matches
+
+    def counts(self, text):
+        """keyword -> number of occurrences (only keywords that occur)"""
+        counts = {}
+        for match in self.find_all(text):
+            counts[match.keyword] = counts.get(match.keyword, 0) + 1
+        return counts
+
+    def positions(self, text):
+        """keyword -> start offsets of its occurrences"""
+        positions = {}
+        for match in self.find_all(text):
+            positions.setdefault(match.keyword, []).append(match.start)
+        return positions
@@ -0,0 +1,171 @@
+"""
+进程内指标注册表 - 计数器 / 仪表 / 直方图，供管理接口（JSON）和 /metrics（Prometheus 文本格式）导出
+"""
+import math
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """[(labels dict, value)] snapshot"""
+        with self._lock:
+            return [(dict(key), self._export(value)) for key, value in self._values.items()]
+
+    def _export(self, value):
+        return value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help='', buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = {'counts': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data['counts'][i] += 1
+            data['count'] += 1
+            data['sum'] += value
+
+    def _export(self, value):
+        return {
+            'count': value['count'],
+            'sum': value['sum'],
+            'buckets': dict(zip(self.buckets, value['counts']))
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.type}")
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get_or_create(Counter, name, help)
+
+    def gauge(self, name, help=''):
+        return self._get_or_create(Gauge, name, help)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self):
+        """JSON-friendly view of every metric"""
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.help,
+                'samples': [{'labels': labels, 'value': value} for labels, value in metric.samples()]
+            }
+            for metric in self.metrics()
+        }
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in sorted(labels.items()):
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def render_prometheus(registry=None):
+    """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in (registry or REGISTRY).metrics():
+        help_text = metric.help.replace('\\', '\\\\').replace('\n', '\\n')
+        lines.append(f'# HELP {metric.name} {help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for labels, value in metric.samples():
+            if metric.type != 'histogram':
+                lines.append(f'{metric.name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            # observe() already counts a value in every bucket it fits, so the counts are cumulative
+            for bound, count in value['buckets'].items():
+                bucket_labels = dict(labels, le=_format_value(float(bound)))
+                lines.append(f'{metric.name}_bucket{_format_labels(bucket_labels)} {count}')
+            lines.append(f'{metric.name}_bucket{_format_labels(dict(labels, le="+Inf"))} {value["count"]}')
+            lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+            lines.append(f'{metric.name}_count{_format_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
@@ -0,0 +1,211 @@
+"""
+请求性能剖析 - 每个路由的延迟直方图、SQL 语句数和耗时（SQLAlchemy 事件）、响应大小；
+可选地对一部分请求做栈采样，慢于阈值时把折叠栈（flamegraph.pl / speedscope 可读）写到 PROFILE_DIR
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+REQUESTS = metrics.counter('http_requests_total', 'HTTP requests by route, method and status')
+LATENCY = metrics.histogram('http_request_duration_seconds', 'Request latency by route')
+RESPONSE_SIZE = metrics.histogram('http_response_size_bytes', 'Response body size by route', buckets=SIZE_BUCKETS)
+REQUEST_QUERIES = metrics.histogram('http_request_sql_statements', 'SQL statements issued per request',
+                                    buckets=QUERY_COUNT_BUCKETS)
+SQL_STATEMENTS = metrics.counter('sql_statements_total', 'SQL statements by route (background = outside requests)')
+SQL_SECONDS = metrics.counter('sql_duration_seconds_total', 'Time spent executing SQL by route')
+PROFILES_WRITTEN = metrics.counter('profiles_written_total', 'Slow-request stack profiles written by route')
+
+
+def _route():
+    """Route template rather than the raw path, so /api/stories/1 and /api/stories/2 share a series"""
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+# --- SQL ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the per-statement execution context, which is simply dropped when the statement raises
+    if context is not None:
+        context.profiling_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'profiling_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    # g is per app context: requests count their own statements, scheduler jobs are 'background'
+    stats = g.get('sql_stats') if has_app_context() else None
+    if stats is not None:
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+    else:
+        SQL_STATEMENTS.inc(route='background')
+        SQL_SECONDS.inc(elapsed, route='background')
+
+
+_sql_hooks_lock = threading.Lock()
+_sql_hooks_installed = False
+
+
+def _install_sql_hooks():
+    """Listen on the Engine class, so every engine (including ones created later) is covered once"""
+    global _sql_hooks_installed
+    with _sql_hooks_lock:
+        if not _sql_hooks_installed:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _sql_hooks_installed = True
+
+
+# --- Stack sampling ---
+
+class StackSampler:
+    """
+    One daemon thread that, while any request is being profiled, snapshots the stacks of those
+    request threads every interval seconds into per-request Counters of collapsed stacks.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}  # thread id -> Counter
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._targets.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            # Cleared before looking, so a start() racing with an empty snapshot still wakes us
+            self._wakeup.clear()
+            with self._lock:
+                targets = dict(self._targets)
+            if not targets:
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+
+def _collapse(frame):
+    """root;...;leaf with one 'function (file:line)' entry per frame"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# Interval set by init_app from PROFILE_INTERVAL_MS
+_sampler = StackSampler(0.005)
+
+
+def _write_profile(route, method, elapsed, samples):
+    profile_dir = current_app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    path = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{method}_{slug}_{elapsed * 1000:.0f}ms.folded")
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    PROFILES_WRITTEN.inc(route=route)
+    print(f"🔥 慢请求 {method} {route} {elapsed * 1000:.0f}ms，栈采样已写入 {path}")
+
+
+# --- Request hooks ---
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.sql_stats = {'count': 0, 'seconds': 0.0}
+    sample_rate = current_app.config['PROFILE_SAMPLE_RATE']
+    if sample_rate > 0 and random.random() < sample_rate:
+        g.profile_thread = threading.get_ident()
+        _sampler.start(g.profile_thread)
+
+
+def _after_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route, method = _route(), request.method
+
+    REQUESTS.inc(route=route, method=method, status=response.status_code)
+    LATENCY.observe(elapsed, route=route, method=method)
+    # Set for buffered bodies and by send_file; unknown only for generator responses
+    size = response.content_length
+    if size is not None:
+        RESPONSE_SIZE.observe(size, route=route)
+
+    stats = g.pop('sql_stats', None)
+    if stats is not None:
+        REQUEST_QUERIES.observe(stats['count'], route=route)
+        SQL_STATEMENTS.inc(stats['count'], route=route)
+        SQL_SECONDS.inc(stats['seconds'], route=route)
+
+    thread_id = g.pop('profile_thread', None)
+    if thread_id is not None:
+        samples = _sampler.stop(thread_id)
+        if elapsed * 1000 >= current_app.config['PROFILE_SLOW_MS'] and samples:
+            try:
+                _write_profile(route, method, elapsed, samples)
+            except OSError as e:
+                print(f"⚠️ 写入栈采样失败: {e}")
+    return response
+
+
+def _teardown_request(exc):
+    # If an after_request hook raised, ours may not have run; make sure the sampler lets go of the thread
+    thread_id = g.pop('profile_thread', None)
+    if thread_id is not None:
+        _sampler.stop(thread_id)
+
+
+def init_app(app):
+    """
+    Register the request hooks on app and the SQL hooks on every engine. Settings not in app.config
+    are read from the environment here, after .env has been loaded:
+    PROFILE_SAMPLE_RATE (fraction of requests stack-sampled, 0 = off), PROFILE_SLOW_MS (sampled
+    requests slower than this are written out), PROFILE_INTERVAL_MS and PROFILE_DIR.
+    """
+    app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.getenv('PROFILE_SAMPLE_RATE', 0)))
+    app.config.setdefault('PROFILE_SLOW_MS', float(os.getenv('PROFILE_SLOW_MS', 500)))
+    app.config.setdefault('PROFILE_INTERVAL_MS', float(os.getenv('PROFILE_INTERVAL_MS', 5)))
+    app.config.setdefault('PROFILE_DIR', os.getenv('PROFILE_DIR', 'profiles'))
+    _sampler.interval = app.config['PROFILE_INTERVAL_MS'] / 1000
+    _install_sql_hooks()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,192 @@
+"""
+批量渲染证据图片 - 扫描 Evidence 表和渲染清单，只在进程池里重渲缺失或过期（配方/渲染器版本变了）的图片；
+过期图片换一个带配方哈希的新文件名并更新 Evidence.file_path（/evidence/ 按 immutable 缓存，同名覆盖客户端看不到）
+
+用法:
+    python render_evidence.py                   # 渲染缺失和过期的图片
+    python render_evidence.py --dry-run         # 只列出要渲染的文件
+    python render_evidence.py --story 12 --workers 4
+    python render_evidence.py --rerender-untracked
+
+每张图片渲染完成后立即追加到清单（EVIDENCE_MANIFEST），中断后重新运行会跳过已完成的部分；
+每次运行结束时清单会压缩成每个文件一条。旧文件不再被引用，由证据清理（evidence_storage.py gc）删除。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import as_completed
+
+from dotenv import load_dotenv
+
+# Loaded before evidence_storage reads EVIDENCE_MANIFEST, so this process and the render
+# workers it spawns use the same manifest
+load_dotenv()
+
+from evidence_storage import compact_manifest, read_manifest, recipe_hash, record_render
+from generate_placeholder_images import RENDER_VERSION, evidence_path
+
+_RERENDER_SUFFIX = re.compile(r'-r[0-9a-f]{8}$')
+
+
+def rerendered_filename(filename, recipe):
+    """
+    evidence_x_1.jpg -> evidence_x_1-r<recipe hash>.jpg: re-rendered bytes need a new URL because
+    /evidence/ is cached as immutable. A later re-render replaces the suffix rather than adding one.
+    """
+    stem, ext = os.path.splitext(filename)
+    return f"{_RERENDER_SUFFIX.sub('', stem)}-r{recipe_hash(recipe, RENDER_VERSION)[:8]}{ext}"
+
+
+def evidence_recipes(story_id=None):
+    """file name -> recipe for every image Evidence row that has one (first row wins for shared files)"""
+    from app import db, Evidence
+
+    query = db.session.query(Evidence.file_path, Evidence.render_recipe).filter(
+        Evidence.evidence_type == 'image',
+        Evidence.render_recipe.isnot(None)
+    )
+    if story_id is not None:
+        query = query.filter(Evidence.story_id == story_id)
+
+    recipes = {}
+    for file_path, raw in query.yield_per(1000):
+        filename = file_path.rsplit('/', 1)[-1]
+        if filename in recipes:
+            continue
+        try:
+            recipes[filename] = json.loads(raw)
+        except ValueError:
+            print(f"⚠️ 无法解析渲染配方: {filename}")
+    db.session.rollback()
+    return recipes
+
+
+def plan(recipes, manifest, rerender_untracked=False):
+    """
+    Split the recipes into work: [(filename, target, recipe, reason)] to render, where reason is
+    'missing', 'stale' or 'untracked', plus the untracked files to adopt as they are.
+    Missing files are rendered under their own name; stale and untracked ones, whose bytes clients
+    may have cached, under rerendered_filename.
+    """
+    todo, adopt = [], []
+    for filename, recipe in sorted(recipes.items()):
+        entry = manifest.get(filename)
+        if entry is not None and entry['hash'] != recipe_hash(recipe, RENDER_VERSION):
+            todo.append((filename, rerendered_filename(filename, recipe), recipe, 'stale'))
+        elif not os.path.exists(evidence_path(filename)):
+            todo.append((filename, filename, recipe, 'missing'))
+        elif entry is None:
+            # Rendered before the manifest existed (or copied in); renders are deterministic,
+            # so by default trust the file and just record it
+            if rerender_untracked:
+                todo.append((filename, rerendered_filename(filename, recipe), recipe, 'untracked'))
+            else:
+                adopt.append((filename, recipe))
+    return todo, adopt
+
+
+def repoint_evidence(filename, target):
+    """Point every Evidence row of filename at target; returns the number of rows updated"""
+    from app import db, Evidence
+
+    updated = db.session.execute(
+        db.update(Evidence)
+        .where(Evidence.file_path == f'/evidence/{filename}')
+        .values(file_path=f'/evidence/{target}')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return updated
+
+
+def render_all(todo, app):
+    """
+    Render todo across the pool with a progress line per file, moving the Evidence rows of each
+    renamed file over as soon as its render finishes; returns (rendered, failed)
+    """
+    import render_service
+
+    total = len(todo)
+    futures = {
+        render_service.submit(recipe['kind'], target, *recipe['args'], force=True): (filename, target)
+        for filename, target, recipe, _ in todo
+    }
+    started = time.monotonic()
+    rendered = failed = 0
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            filename, target = futures[future]
+            try:
+                future.result()
+                if target != filename:
+                    with app.app_context():
+                        repoint_evidence(filename, target)
+                rendered += 1
+                status = '✅'
+            except Exception as e:
+                failed += 1
+                status = f'❌ {e}'
+            elapsed = time.monotonic() - started
+            eta = elapsed / done * (total - done)
+            name = filename if target == filename else f'{filename} -> {target}'
+            print(f"[{done}/{total}] {status} {name} ({done / elapsed:.1f}/s, 剩余约 {eta:.0f}s)")
+    except KeyboardInterrupt:
+        print("\n⏹️ 已中断，已完成的图片记录在清单里，重新运行会继续")
+        render_service.shutdown(wait=False, cancel_futures=True)
+        raise
+    render_service.shutdown()
+    return rendered, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render missing or stale evidence images')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be rendered')
+    parser.add_argument('--story', type=int, help='only this story id')
+    parser.add_argument('--workers', type=int, help='render processes (default RENDER_WORKERS or one per core)')
+    parser.add_argument('--rerender-untracked', action='store_true',
+                        help='re-render existing files that have no manifest entry instead of adopting them')
+    args = parser.parse_args(argv)
+
+    if args.workers is not None:
+        os.environ['RENDER_WORKERS'] = str(args.workers)
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        recipes = evidence_recipes(args.story)
+    todo, adopt = plan(recipes, read_manifest(), args.rerender_untracked)
+
+    counts = {}
+    for _, _, _, reason in todo:
+        counts[reason] = counts.get(reason, 0) + 1
+    summary = '，'.join(f'{reason} {count}' for reason, count in sorted(counts.items())) or '无'
+    print(f"🖼️ {len(recipes)} 张证据图片（渲染器版本 {RENDER_VERSION}）：待渲染 {summary}；"
+          f"未记录但已存在 {len(adopt)}")
+
+    if args.dry_run:
+        for filename, target, recipe, reason in todo:
+            name = filename if target == filename else f'{filename} -> {target}'
+            print(f"  {reason:<9} {name} ({recipe['kind']})")
+        return 0
+
+    for filename, recipe in adopt:
+        record_render(filename, recipe, RENDER_VERSION)
+
+    failed = 0
+    if todo:
+        rendered, failed = render_all(todo, app)
+        print(f"{'✅' if not failed else '⚠️'} 渲染完成: {rendered} 成功，{failed} 失败")
+    else:
+        print("✅ 没有需要渲染的图片")
+    print(f"🗜️ 渲染清单已压缩为 {compact_manifest()} 条")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,164 @@
+"""
+证据图片渲染服务 - 用进程池并行渲染 PIL 图片，绕开 GIL；一个故事的多张图片以及状态推进时多个故事的图片共用同一个池
+"""
+import multiprocessing
+import os
+import random
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Seconds a request waits for a lazy render
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT_SECONDS', 30))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# (kind, file name) -> Future of the render in flight, so concurrent requests share one render
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _init_worker():
+    # Workers started by fork inherit the parent's RNG state; reseed so they don't draw identical images
+    random.seed()
+
+
+def _render(kind, filename, args):
+    """Runs in a worker process; returns the file name written under static/evidence"""
+    from generate_placeholder_images import (
+        create_found_footage_image, create_abstract_image, make_variants, RENDER_VERSION
+    )
+    from evidence_storage import record_render
+
+    if kind == 'variants':
+        make_variants(filename)
+        return filename
+    if kind == 'abstract':
+        create_abstract_image(filename, *args)
+    elif kind == 'found_footage':
+        create_found_footage_image(filename, *args)
+    else:
+        raise ValueError(f"Unknown render kind: {kind}")
+    record_render(filename, {'kind': kind, 'args': args}, RENDER_VERSION)
+    return filename
+
+
+def get_pool():
+    """
+    Shared process pool (RENDER_WORKERS processes, default one per core).
+    RENDER_WORKERS=0 renders in the calling thread instead.
+    """
+    global _pool
+    workers = int(os.getenv('RENDER_WORKERS') or os.cpu_count() or 1)
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn by default: forking a process that already runs scheduler threads is unsafe
+            context = multiprocessing.get_context(os.getenv('RENDER_START_METHOD', 'spawn'))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker)
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(kind, filename, *args, force=False):
+    """
+    Render one image ('found_footage': text, scene_type, seed / 'abstract': color_scheme, seed),
+    or the size/format variants of an existing one ('variants').
+    Returns a Future resolving to the file name; a file that already exists is reused without
+    rendering unless force is set.
+    """
+    from generate_placeholder_images import evidence_path
+
+    if not force and kind != 'variants' and os.path.exists(evidence_path(filename)):
+        future = Future()
+        future.set_result(filename)
+        return future
+
+    pool = get_pool()
+    if pool is not None:
+        try:
+            return pool.submit(_render, kind, filename, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool and retry once
+            print("⚠️ 渲染进程池已损坏，重新创建")
+            _discard_pool(pool)
+            pool = get_pool()
+            return pool.submit(_render, kind, filename, args)
+
+    future = Future()
+    try:
+        future.set_result(_render(kind, filename, args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def render_once(filename, kind, *args):
+    """
+    submit() with single-flight: while a file is being rendered, later callers get the same Future.
+    Separate processes may still render the same file concurrently; renders are deterministic and
+    written with an atomic rename, so the last one wins harmlessly.
+    """
+    key = (kind, filename)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = submit(kind, filename, *args)
+    if owner:
+        future.add_done_callback(lambda done: _forget(key, done))
+    return future
+
+
+def _forget(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+def ensure_evidence_file(filename, find_recipe):
+    """
+    Make sure static/evidence/<filename> exists, rendering it if needed. filename may be a size/format
+    variant; find_recipe(base file name) returns the stored recipe dict or None.
+    Returns False for unknown files; raises if the render fails or times out.
+    """
+    from generate_placeholder_images import evidence_path, parse_variant_filename
+
+    # filename comes straight from the URL; only plain names may reach the shard paths
+    if os.path.basename(filename) != filename or '..' in filename:
+        return False
+
+    if os.path.exists(evidence_path(filename)):
+        return True
+
+    variant = parse_variant_filename(filename)
+    base = variant[0] if variant else filename
+    if not os.path.exists(evidence_path(base)):
+        recipe = find_recipe(base)
+        if recipe is None:
+            return False
+        render_once(base, recipe['kind'], *recipe['args']).result(timeout=RENDER_TIMEOUT)
+
+    if variant and not os.path.exists(evidence_path(filename)):
+        # Rendered before variants existed
+        render_once(base, 'variants').result(timeout=RENDER_TIMEOUT)
+
+    # A variant in a format this Pillow can't encode still doesn't exist
+    return os.path.exists(evidence_path(filename))
+
+
+def shutdown(wait=True, cancel_futures=False):
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=cancel_futures)
@@ -0,0 +1,164 @@
+"""
+调度任务监控 - 记录每个任务的耗时、启动延迟、重叠/跳过次数和异常，最近的运行记录保存在 scheduler_run 表中，
+任何 worker 都能读到
+"""
+import functools
+import threading
+import time
+from datetime import datetime, timezone
+
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+import metrics
+
+JOB_DURATION = metrics.histogram('scheduler_job_duration_seconds', 'Scheduled job run time')
+JOB_START_LAG = metrics.histogram('scheduler_job_start_lag_seconds', 'Delay between scheduled and actual start')
+JOB_RUNS = metrics.counter('scheduler_job_runs_total', 'Finished job runs by status')
+JOB_SKIPPED = metrics.counter('scheduler_job_skipped_total', 'Job runs that did not happen, by reason')
+JOB_OVERRUNS = metrics.counter('scheduler_job_overruns_total', 'Runs that took longer than the job interval')
+JOB_RUNNING = metrics.gauge('scheduler_job_running', 'Job runs currently in progress')
+
+HISTORY_SIZE = 50
+
+
+class SchedulerMonitor:
+    """
+    Job functions are wrapped with monitored_job() to time the actual run; APScheduler
+    events add the scheduled time, exceptions and the runs that were skipped.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._app = None
+        self._completed = {}  # job_id -> (started_at, duration) of the run that just finished
+        self.history_size = history_size
+
+    def attach(self, scheduler, app):
+        """Listen to scheduler's events; runs are recorded in app's database"""
+        self._scheduler = scheduler
+        self._app = app
+        scheduler.add_listener(
+            self._on_event,
+            EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+        )
+
+    def run_finished(self, job_id, started_at, duration):
+        with self._lock:
+            self._completed[job_id] = (started_at, duration)
+
+    def _on_event(self, event):
+        try:
+            if event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+                self._on_finished(event)
+            elif event.code == EVENT_JOB_MISSED:
+                self._record_skip(event.job_id, 'missed', event.scheduled_run_time)
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                # Previous run still going: an overlap that max_instances=1 prevented
+                for run_time in event.scheduled_run_times:
+                    self._record_skip(event.job_id, 'overlap', run_time)
+        except Exception as e:
+            print(f"⚠️ Scheduler monitor failed on {event}: {e}")
+
+    def _job_interval(self, job_id):
+        job = self._scheduler.get_job(job_id) if self._scheduler else None
+        return getattr(getattr(job, 'trigger', None), 'interval', None)
+
+    def _on_finished(self, event):
+        with self._lock:
+            started_at, duration = self._completed.pop(event.job_id, (None, None))
+
+        status = 'error' if event.code == EVENT_JOB_ERROR else 'success'
+        JOB_RUNS.inc(job=event.job_id, status=status)
+
+        lag = None
+        if started_at is not None and event.scheduled_run_time is not None:
+            lag = max(0.0, (started_at - event.scheduled_run_time).total_seconds())
+            JOB_START_LAG.observe(lag, job=event.job_id)
+
+        overran = False
+        if duration is not None:
+            JOB_DURATION.observe(duration, job=event.job_id)
+            interval = self._job_interval(event.job_id)
+            if interval and duration > interval.total_seconds():
+                overran = True
+                JOB_OVERRUNS.inc(job=event.job_id)
+                print(f"⚠️ Job {event.job_id} took {duration:.1f}s, longer than its {interval} interval")
+
+        self._store_run(
+            event.job_id, event.scheduled_run_time, status,
+            duration_seconds=round(duration, 3) if duration is not None else None,
+            start_lag_seconds=round(lag, 3) if lag is not None else None,
+            overran_interval=overran,
+            error=repr(event.exception) if event.exception is not None else None
+        )
+
+    def _record_skip(self, job_id, reason, run_time):
+        JOB_SKIPPED.inc(job=job_id, reason=reason)
+        self._store_run(job_id, run_time, f'skipped_{reason}')
+
+    def _store_run(self, job_id, scheduled_run_time, status, **fields):
+        """Insert one run and trim the job's history to the most recent history_size runs"""
+        from app import db, SchedulerRun
+
+        if self._app is None:
+            return
+        if scheduled_run_time is not None:
+            # Stored naive UTC like every other timestamp in the database
+            scheduled_run_time = scheduled_run_time.astimezone(timezone.utc).replace(tzinfo=None)
+        with self._app.app_context():
+            try:
+                db.session.add(SchedulerRun(job_id=job_id, scheduled_run_time=scheduled_run_time,
+                                            status=status, **fields))
+                db.session.flush()
+                keep = db.select(SchedulerRun.id).where(SchedulerRun.job_id == job_id) \
+                    .order_by(SchedulerRun.id.desc()).limit(self.history_size)
+                db.session.execute(
+                    db.delete(SchedulerRun)
+                    .where(SchedulerRun.job_id == job_id, SchedulerRun.id.not_in(keep))
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def history(self):
+        """{job_id: [runs, most recent first]} from the scheduler_run table; needs an app context"""
+        from app import SchedulerRun
+
+        history = {}
+        for run in SchedulerRun.query.order_by(SchedulerRun.job_id, SchedulerRun.id.desc()):
+            history.setdefault(run.job_id, []).append({
+                'scheduled_run_time': run.scheduled_run_time.isoformat() if run.scheduled_run_time else None,
+                'status': run.status,
+                'duration_seconds': run.duration_seconds,
+                'start_lag_seconds': run.start_lag_seconds,
+                'overran_interval': run.overran_interval,
+                'error': run.error
+            })
+        return history
+
+
+_monitor = SchedulerMonitor()
+
+
+def get_monitor():
+    return _monitor
+
+
+def monitored_job(job_id):
+    """Decorator for scheduled job functions: times each run and reports it to the monitor"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = datetime.now(timezone.utc)
+            started = time.monotonic()
+            JOB_RUNNING.inc(job=job_id)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                JOB_RUNNING.dec(job=job_id)
+                _monitor.run_finished(job_id, started_at, time.monotonic() - started)
+        return wrapper
+    return decorator
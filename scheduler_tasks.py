@@ -1,19 +1,48 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import functools
 import os
+import socket
+import threading
+import time
+import uuid
+import metrics
+from generation_controller import get_controller, publish_load, record_provider_latency, withdraw_load
+from scheduler_monitor import get_monitor, monitored_job
+from transition_timer import start_transition_timer, stop_transition_timer, get_timer
 
+# SchedulerHost of this process (set by start_scheduler)
+_host = None
+
+# A story whose transition raised is retried after base * 2^(failures - 1) seconds, up to the max
+TRANSITION_RETRY_BASE_SECONDS = int(os.getenv('TRANSITION_RETRY_BASE_SECONDS', 60))
+TRANSITION_RETRY_MAX_SECONDS = int(os.getenv('TRANSITION_RETRY_MAX_SECONDS', 3600))
+
+TRANSITION_FAILURES = metrics.counter('story_transition_failures_total', 'State transitions that raised')
+
+def _job_app():
+    """
+    App of the scheduler host running the jobs. Jobs live in the persistent job store,
+    which can't pickle an app, so they look it up here instead of taking it as an argument.
+    """
+    return _host.app
+
+@monitored_job('story_generation')
 def scheduled_story_generation():
     """Scheduled task to generate new AI stories"""
-    from app import app, db, Story, Evidence
-    from ai_engine import generate_ai_story_with_meta, should_generate_new_story, generate_evidence_image
+    from app import db, Story, Evidence
+    from ai_engine import generate_ai_story_with_meta, should_generate_new_story, plan_evidence_images
     from story_engine import initialize_story_state
     import random
     
-    with app.app_context():
+    with _job_app().app_context():
         print(f"[{datetime.now()}] Running scheduled story generation...")
         
         if should_generate_new_story():
+            started = time.monotonic()
             story_data = generate_ai_story_with_meta()
+            record_provider_latency(time.monotonic() - started)
             
             if story_data:
                 story = Story(
@@ -30,9 +59,9 @@ def scheduled_story_generation():
                 
                 initialize_story_state(story)
                 
-                # 自动生成证据图片
+                # 自动生成证据图片（首次访问时才渲染）
                 try:
-                    evidence_paths = generate_evidence_image(
+                    evidence_images = plan_evidence_images(
                         story_data['title'], 
                         story_data['content'],
                         story_data.get('category', 'urban_legend')
@@ -46,18 +75,19 @@ def scheduled_story_generation():
                         '【诡异】这张是什么情况？我发誓拍的时候没看到这个...（低光模式，有噪点）'
                     ]
                     
-                    for idx, evidence_path in enumerate(evidence_paths):
+                    for idx, image in enumerate(evidence_images):
                         from datetime import timedelta
                         evidence = Evidence(
                             story_id=story.id,
                             evidence_type='image',
-                            file_path=evidence_path,
+                            file_path=image['file_path'],
+                            render_recipe=image['render_recipe'],
                             description=evidence_descriptions[idx % len(evidence_descriptions)],
                             created_at=datetime.utcnow() - timedelta(minutes=random.randint(10, 120))
                         )
                         db.session.add(evidence)
                     
-                    print(f"✅ 为故事创建了 {len(evidence_paths)} 个证据项")
+                    print(f"✅ 为故事创建了 {len(evidence_images)} 个证据项")
                 except Exception as e:
                     print(f"⚠️ 生成证据图片失败: {e}")
                 
@@ -68,52 +98,437 @@ def scheduled_story_generation():
                 print("❌ Failed to generate story")
         else:
             print("⏭️  Skipped: Max active stories reached")
+        
+        try:
+            adjust_generation_interval()
+        except Exception as e:
+            print(f"⚠️ Failed to adjust generation interval: {e}")
 
-def scheduled_state_progression():
-    """Check and progress story states"""
-    from app import app, db, Story
+def adjust_generation_interval():
+    """Let the generation controller pick the interval until the next story generation run"""
+    interval_minutes = get_controller().update()
+    
+    scheduler = _host.scheduler if _host else None
+    if scheduler is None:
+        return
+    job = scheduler.get_job('story_generation')
+    if job and abs(job.trigger.interval.total_seconds() - interval_minutes * 60) >= 1:
+        scheduler.reschedule_job('story_generation', trigger='interval', seconds=interval_minutes * 60)
+
+def progress_story(app, story_id):
+    """
+    Transition a single story if it is due, returns True if it transitioned.
+    If the transition raises, the failure is recorded and the story backs off before it is retried.
+    """
+    from app import db
+    
+    with app.app_context():
+        try:
+            return _progress_story(story_id)
+        except Exception as e:
+            db.session.rollback()
+            _record_transition_failure(story_id, e)
+            raise
+
+def _progress_story(story_id):
+    from app import db, Story
     from story_engine import check_state_transition, transition_story_state
     
+    story = Story.query.get(story_id)
+    if not story or story.current_state == 'ended':
+        return False
+    
+    if check_state_transition(story):
+        print(f"🔄 Transitioning story: {story.title}")
+        if not transition_story_state(story):
+            print(f"⏭️  Story {story_id} was already transitioned")
+            return False
+        print(f"✅ Story transitioned to: {story.current_state}")
+        return True
+    
+    # Deadline moved or story was re-initialized; make sure the new deadline is tracked
+    db.session.commit()
+    timer = get_timer()
+    if timer and story.next_transition_at:
+        timer.schedule(story.id, story.next_transition_at)
+    return False
+
+def _record_transition_failure(story_id, error):
+    """
+    Count the failure and keep the error on the story, and move its deadline back exponentially,
+    so the timer, the due poll and the sweep all leave it alone until the retry is due
+    """
+    from app import db, Story
+    
+    TRANSITION_FAILURES.inc()
+    try:
+        failures = db.session.execute(
+            db.update(Story)
+            .where(Story.id == story_id)
+            .values(transition_failures=Story.transition_failures + 1, transition_error=repr(error)[:500])
+            .returning(Story.transition_failures)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+        if failures is None:
+            db.session.rollback()
+            return
+        delay = min(TRANSITION_RETRY_BASE_SECONDS * 2 ** (failures - 1), TRANSITION_RETRY_MAX_SECONDS)
+        retry_at = datetime.utcnow() + timedelta(seconds=delay)
+        db.session.execute(
+            db.update(Story)
+            .where(Story.id == story_id)
+            .values(next_transition_at=retry_at)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ 记录状态转换失败时出错 story_id={story_id}: {e}")
+        return
+    
+    timer = get_timer()
+    if timer:
+        timer.schedule(story_id, retry_at)
+    print(f"⏳ 故事 {story_id} 第 {failures} 次转换失败，{delay}s 后重试")
+
+@monitored_job('state_progression')
+def scheduled_state_progression():
+    """Safety-net sweep: progress due stories the timer may have missed, in parallel"""
+    from app import db, Story
+    from story_engine import INTERACTION_THRESHOLD
+    
+    app = _job_app()
     with app.app_context():
         print(f"[{datetime.now()}] Checking story state transitions...")
+        started = time.monotonic()
         
-        active_stories = Story.query.filter(Story.current_state != 'ended').all()
-        
-        for story in active_stories:
-            if check_state_transition(story):
-                print(f"🔄 Transitioning story: {story.title}")
-                transition_story_state(story, app.app_context)
-                db.session.commit()
-                print(f"✅ Story transitioned to: {story.current_state}")
+        due_ids = [row.id for row in db.session.query(Story.id).filter(
+            Story.current_state != 'ended',
+            db.or_(
+                Story.next_transition_at.is_(None),
+                Story.next_transition_at <= datetime.utcnow(),
+                Story.interaction_count >= INTERACTION_THRESHOLD
+            )
+        )]
+        db.session.rollback()
+    
+    # Each story runs in its own app context/session, so one failure can't affect the others
+    transitioned = failures = 0
+    workers = int(os.getenv('STATE_SWEEP_WORKERS', 4))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='state-sweep') as pool:
+        futures = {pool.submit(progress_story, app, story_id): story_id for story_id in due_ids}
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    transitioned += 1
+            except Exception as e:
+                failures += 1
+                print(f"⚠️ 状态转换失败 story_id={futures[future]}: {e}")
+    
+    report = {
+        'duration_seconds': round(time.monotonic() - started, 3),
+        'stories_processed': len(due_ids),
+        'stories_transitioned': transitioned,
+        'failures': failures
+    }
+    print(f"✅ State sweep finished in {report['duration_seconds']}s: "
+          f"{len(due_ids)} processed, {transitioned} transitioned, {failures} failed")
+    return report
 
-def start_scheduler(app):
-    """Initialize and start the background scheduler"""
-    scheduler = BackgroundScheduler()
+@monitored_job('stats_reconcile')
+def scheduled_stats_reconcile():
+    """Recompute the maintained story counters from the story table"""
+    from story_stats import reconcile_story_stats
     
-    # Generate new stories every 5 minutes
+    with _job_app().app_context():
+        values = reconcile_story_stats()
+        print(f"[{datetime.now()}] Story stats reconciled: {values.get('active_stories', 0)} active")
+
+@monitored_job('evidence_gc')
+def scheduled_evidence_gc():
+    """Delete evidence files whose stories are gone"""
+    from evidence_storage import collect_garbage
+    
+    with _job_app().app_context():
+        return collect_garbage()
+
+# How often the leader looks for deadlines it did not schedule itself
+DUE_POLL_SECONDS = int(os.getenv('DUE_POLL_SECONDS', 15))
+
+LEASE_NAME = 'scheduler'
+# Table of the persistent APScheduler job store
+JOBSTORE_TABLE = 'apscheduler_jobs'
+
+@monitored_job('due_transition_poll')
+def poll_due_transitions():
+    """Hand deadlines written by other workers (new stories, interaction thresholds) to the timer"""
+    from app import db, Story
+    
+    timer = get_timer()
+    if timer is None:
+        return
+    
+    horizon = datetime.utcnow() + timedelta(seconds=DUE_POLL_SECONDS)
+    with _job_app().app_context():
+        rows = db.session.query(Story.id, Story.next_transition_at).filter(
+            Story.current_state != 'ended',
+            Story.next_transition_at <= horizon
+        ).all()
+    
+    for story_id, due_at in rows:
+        if timer.deadline(story_id) != due_at:
+            timer.schedule(story_id, due_at)
+
+def _configure_jobs(scheduler):
+    """
+    Add the periodic jobs that aren't in the job store yet. Existing jobs keep their persisted next
+    run time; a fixed-interval job is only rescheduled when its configured interval changed, and
+    story generation keeps the interval the controller chose under the previous leader.
+    """
     story_interval_minutes = int(os.getenv('STORY_GEN_INTERVAL_MINUTES', 5))
-    scheduler.add_job(
-        func=scheduled_story_generation,
-        trigger='interval',
-        minutes=story_interval_minutes,
-        id='story_generation',
-        name='Generate new AI urban legends',
-        replace_existing=True
-    )
-    
-    # Check story state progression every 30 minutes
-    scheduler.add_job(
-        func=scheduled_state_progression,
-        trigger='interval',
-        minutes=30,
-        id='state_progression',
-        name='Progress story states',
-        replace_existing=True
-    )
-    
-    scheduler.start()
-    print("✅ Background scheduler started!")
+    sweep_interval_minutes = int(os.getenv('STATE_SWEEP_INTERVAL_MINUTES', 360))
+    
+    jobs = [
+        ('story_generation', scheduled_story_generation, 'Generate new AI urban legends',
+         timedelta(minutes=story_interval_minutes)),
+        # State transitions are driven by the timer; the sweep only catches anything it missed
+        ('state_progression', scheduled_state_progression, 'Progress story states',
+         timedelta(minutes=sweep_interval_minutes)),
+        ('due_transition_poll', poll_due_transitions, 'Load due transitions into the timer',
+         timedelta(seconds=DUE_POLL_SECONDS)),
+        ('stats_reconcile', scheduled_stats_reconcile, 'Reconcile story counters',
+         timedelta(minutes=int(os.getenv('STATS_RECONCILE_MINUTES', 60)))),
+        ('evidence_gc', scheduled_evidence_gc, 'Delete orphaned evidence files',
+         timedelta(hours=int(os.getenv('EVIDENCE_GC_HOURS', 24)))),
+    ]
+    
+    for job_id, func, name, interval in jobs:
+        job = scheduler.get_job(job_id)
+        if job is None:
+            scheduler.add_job(func=func, trigger='interval', seconds=interval.total_seconds(),
+                              id=job_id, name=name, replace_existing=False)
+        elif job_id == 'story_generation':
+            get_controller().resume(job.trigger.interval.total_seconds() / 60)
+        elif job.trigger.interval != interval:
+            scheduler.reschedule_job(job_id, trigger='interval', seconds=interval.total_seconds())
+    
     print(f"   - Story generation: every {story_interval_minutes} minutes")
-    print(f"   - State progression: every 30 minutes")
+    print(f"   - State progression: on deadline (sweep every {sweep_interval_minutes} minutes)")
+
+class SchedulerHost:
+    """
+    Runs the scheduled jobs in exactly one process. Every web worker runs a host; they
+    compete for a lease row in the database and only the current holder runs the
+    APScheduler instance (persistent job store) and the transition timer.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = int(os.getenv('SCHEDULER_LEASE_SECONDS', 30))
+        self.misfire_grace_seconds = int(os.getenv('SCHEDULER_MISFIRE_GRACE_SECONDS', 300))
+        self.scheduler = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @property
+    def is_leader(self):
+        return self.scheduler is not None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='scheduler-lease', daemon=True)
+        self._thread.start()
+        print(f"✅ Scheduler host started ({self.holder})")
+        return self
+    
+    def shutdown(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._step_down()
+        self._release()
+        try:
+            with self.app.app_context():
+                withdraw_load(self.holder)
+        except Exception as e:
+            print(f"⚠️ Failed to withdraw worker load: {e}")
+    
+    def _run(self):
+        # Heartbeat well inside the lease so a live leader never loses it
+        while not self._stop.is_set():
+            # Every worker reports its reply backlog and latency for the leader's generation controller
+            try:
+                with self.app.app_context():
+                    publish_load(self.holder)
+            except Exception as e:
+                print(f"⚠️ Failed to publish worker load: {e}")
+            
+            try:
+                acquired = self._try_acquire()
+            except Exception as e:
+                print(f"⚠️ Scheduler lease check failed: {e}")
+                acquired = False
+            
+            try:
+                if acquired and not self.is_leader:
+                    self._become_leader()
+                elif not acquired and self.is_leader:
+                    self._step_down()
+            except Exception as e:
+                # Keep the loop alive: a dead lease thread would hold the lease until it
+                # expires and never compete for it again
+                print(f"⚠️ Scheduler leadership change failed: {e}")
+            
+            self._stop.wait(self.lease_seconds / 3)
+    
+    def _try_acquire(self):
+        """Take or renew the lease; only succeeds if we hold it or it has expired"""
+        from app import db, SchedulerLease
+        from sqlalchemy.exc import IntegrityError
+        
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        
+        with self.app.app_context():
+            result = db.session.execute(
+                db.update(SchedulerLease)
+                .where(
+                    SchedulerLease.name == LEASE_NAME,
+                    db.or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now)
+                )
+                .values(holder=self.holder, expires_at=expires_at)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                if db.session.get(SchedulerLease, LEASE_NAME) is not None:
+                    db.session.rollback()
+                    return False
+                db.session.add(SchedulerLease(name=LEASE_NAME, holder=self.holder, expires_at=expires_at))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()  # another worker created the lease first
+                return False
+            return True
     
-    return scheduler
+    def _release(self):
+        from app import db, SchedulerLease
+        
+        try:
+            with self.app.app_context():
+                db.session.execute(
+                    db.update(SchedulerLease)
+                    .where(SchedulerLease.name == LEASE_NAME, SchedulerLease.holder == self.holder)
+                    .values(expires_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+        except Exception as e:
+            print(f"⚠️ Failed to release scheduler lease: {e}")
+    
+    def _become_leader(self):
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        from app import db
+        
+        with self.app.app_context():
+            engine = db.engine
+        
+        scheduler = BackgroundScheduler(
+            jobstores={'default': SQLAlchemyJobStore(engine=engine, tablename=JOBSTORE_TABLE)},
+            job_defaults={
+                'coalesce': True,
+                'max_instances': 1,
+                'misfire_grace_time': self.misfire_grace_seconds
+            }
+        )
+        get_monitor().attach(scheduler, self.app)
+        scheduler.start(paused=True)
+        self.scheduler = scheduler
+        print(f"👑 Elected scheduler leader ({self.holder})")
+        try:
+            _configure_jobs(scheduler)
+            start_transition_timer(self.app, functools.partial(progress_story, self.app))
+            scheduler.resume()
+        except Exception as e:
+            # Don't sit on the lease with a paused scheduler: shut down and let any worker retry
+            print(f"❌ Failed to start as scheduler leader ({self.holder}): {e}")
+            self._step_down()
+            self._release()
+    
+    def _step_down(self):
+        if self.scheduler is None:
+            return
+        scheduler, self.scheduler = self.scheduler, None
+        try:
+            scheduler.shutdown(wait=False)
+        finally:
+            stop_transition_timer()
+        print(f"⏹️  Scheduler leadership released ({self.holder})")
+
+def stored_jobs():
+    """
+    Jobs as persisted in the job store table, so any worker can list them. The rows are unpickled
+    here rather than through SQLAlchemyJobStore, which deletes jobs it fails to restore.
+    """
+    import pickle
+    from sqlalchemy import inspect
+    from app import db
+    
+    if not inspect(db.engine).has_table(JOBSTORE_TABLE):
+        return []  # no leader has run yet
+    
+    jobs = []
+    for job_id, job_state in db.session.execute(
+            db.text(f'SELECT id, job_state FROM {JOBSTORE_TABLE} ORDER BY next_run_time')):
+        try:
+            state = pickle.loads(job_state)
+        except Exception as e:
+            print(f"⚠️ 无法读取任务 {job_id}: {e}")
+            continue
+        interval = getattr(state.get('trigger'), 'interval', None)
+        next_run_time = state.get('next_run_time')
+        jobs.append({
+            'id': job_id,
+            'name': state.get('name'),
+            'next_run_time': next_run_time.isoformat() if next_run_time else None,
+            'interval_seconds': interval.total_seconds() if interval else None
+        })
+    return jobs
+
+def scheduler_status():
+    """Lease holder, jobs with their next run times, timer state and recent run history"""
+    from app import SchedulerLease
+    
+    lease = SchedulerLease.query.get(LEASE_NAME)
+    scheduler = _host.scheduler if _host else None
+    # The transition timer lives in the leader's memory; other workers report None
+    timer = get_timer()
+    
+    next_due = timer.next_due() if timer is not None else None
+    return {
+        'host': _host.holder if _host else None,
+        'is_leader': scheduler is not None,
+        'lease': {
+            'holder': lease.holder,
+            'expires_at': lease.expires_at.isoformat() if lease.expires_at else None
+        } if lease else None,
+        'jobs': stored_jobs(),
+        'transition_timer': {
+            'pending': len(timer),
+            'next_due': next_due.isoformat() if next_due else None
+        } if timer is not None else None,
+        'history': get_monitor().history()
+    }
+
+def start_scheduler(app):
+    """Start the scheduler host for this process; jobs only run while it holds the lease"""
+    global _host
+    _host = SchedulerHost(app).start()
+    return _host
+
+def stop_scheduler():
+    """Stop this process's scheduler host (if any) and release the lease"""
+    global _host
+    host, _host = _host, None
+    if host is not None:
+        host.shutdown()
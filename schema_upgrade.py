@@ -0,0 +1,90 @@
+"""
+数据库结构升级 - db.create_all() 只会新建缺失的表；已有表缺少的列在这里用 ALTER TABLE 补上，
+并从旧版 state_data JSON 回填。可重复执行，init-db 每次都会运行
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+
+def _story_state_data(conn, story):
+    """(id, current_state, parsed state_data) for every story that has state_data"""
+    rows = conn.execute(select(story.c.id, story.c.current_state, story.c.state_data)
+                        .where(story.c.state_data.isnot(None))).all()
+    for story_id, state, raw in rows:
+        try:
+            yield story_id, state, json.loads(raw)
+        except ValueError:
+            continue
+
+
+def _backfill_next_transition_at(conn, tables):
+    """The deadline used to live in state_data['next_transition_time']"""
+    from story_engine import STORY_STATES
+
+    story = tables['story']
+    for story_id, state, data in _story_state_data(conn, story):
+        deadline = data.get('next_transition_time')
+        # Ended stories keep a stale deadline in their JSON; they have no next transition
+        if not deadline or not STORY_STATES.get(state, {}).get('next_states'):
+            continue
+        conn.execute(story.update().where(story.c.id == story_id)
+                     .values(next_transition_at=datetime.fromisoformat(deadline)))
+
+
+def _story_counter_backfill(column, key):
+    """Backfill for a counter that used to live in state_data[key]"""
+    def backfill(conn, tables):
+        story = tables['story']
+        for story_id, _, data in _story_state_data(conn, story):
+            if isinstance(data.get(key), int):
+                conn.execute(story.update().where(story.c.id == story_id).values({column: data[key]}))
+    return backfill
+
+
+# (table, column, backfill(conn, tables) or None), in the order they were added to the models
+ADDED_COLUMNS = [
+    ('story', 'next_transition_at', _backfill_next_transition_at),
+    ('story', 'interaction_count', _story_counter_backfill('interaction_count', 'user_interaction_count')),
+    ('story', 'evidence_generated', _story_counter_backfill('evidence_generated', 'evidence_generated')),
+    # Evidence created before lazy rendering already has its file on disk
+    ('evidence', 'render_recipe', None),
+    ('story', 'transition_failures', None),
+    ('story', 'transition_error', None),
+]
+
+
+def upgrade(db):
+    """
+    Add the columns in ADDED_COLUMNS that the database doesn't have yet and backfill them, then
+    create any model index the database lacks, all in one transaction.
+    Returns the 'table.column' names that were added.
+    """
+    engine = db.engine
+    tables = db.metadata.tables
+    existing = {}
+    added = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table_name, column_name, backfill in ADDED_COLUMNS:
+            if table_name not in existing:
+                existing[table_name] = {column['name'] for column in inspector.get_columns(table_name)}
+            if column_name in existing[table_name]:
+                continue
+
+            table = tables[table_name]
+            ddl = CreateColumn(table.c[column_name]).compile(dialect=engine.dialect)
+            conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {ddl}'))
+            if backfill is not None:
+                backfill(conn, tables)
+            existing[table_name].add(column_name)
+            added.append(f'{table_name}.{column_name}')
+            print(f"🔧 数据库升级: 新增列 {table_name}.{column_name}")
+
+        # Indexes on new columns, and ones added to columns that already existed (evidence.file_path)
+        for table in tables.values():
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return added
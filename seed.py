@@ -1,8 +1,15 @@
-from app import app, db, Story, Comment, Evidence, Follow, Notification
+from app import app, db, init_db, Story, Comment, Evidence, Follow, Notification, StateTransition
 from datetime import datetime, timedelta
+import json
+import os
 from story_engine import initialize_story_state
+from story_stats import reconcile_story_stats
 
 def create_initial_data():
+    # PIL/numpy are only needed for the placeholder recipes
+    from generate_placeholder_images import placeholder_recipe
+
+    init_db(app)
     with app.app_context():
         # Clear existing data
         print("🗑️  清空现有数据...")
@@ -10,6 +17,7 @@ def create_initial_data():
         Evidence.query.delete()
         Follow.query.delete()
         Notification.query.delete()
+        StateTransition.query.delete()
         Story.query.delete()
         db.session.commit()
 
@@ -109,7 +117,9 @@ def create_initial_data():
         )
         initialize_story_state(zombie_story)
         db.session.add(zombie_story)
-        zombie_story.state_data = '{"current_state": "ended", "state_history": [{"state": "ended", "trigger": "system_archive"}]}'
+        zombie_story.state_data = '{"current_state": "ended"}'
+        zombie_story.next_transition_at = None
+        zombie_story.transitions.append(StateTransition(state='ended', trigger='system_archive'))
         db.session.flush()  # 获取zombie_story.id
         
         # 为zombie故事添加旧照片证据
@@ -167,7 +177,8 @@ def create_initial_data():
             updated_at=datetime.utcnow() - timedelta(days=10),
             views=54088
         )
-        mystery_story.state_data = '{"current_state": "ending_mystery", "state_history": [{"state": "ending_mystery", "trigger": "user_conclusion"}]}'
+        mystery_story.state_data = '{"current_state": "ending_mystery"}'
+        mystery_story.transitions.append(StateTransition(state='ending_mystery', trigger='user_conclusion'))
         db.session.add(mystery_story)
         db.session.flush()  # 获取mystery_story.id
         
@@ -208,7 +219,15 @@ def create_initial_data():
         )
         db.session.add(mystery_evidence4)
 
+        # 占位图片不必预先生成，首次访问时按配方渲染
+        for evidence in Evidence.query.filter(Evidence.render_recipe.is_(None)):
+            recipe = placeholder_recipe(os.path.basename(evidence.file_path))
+            if recipe:
+                evidence.render_recipe = json.dumps(recipe, ensure_ascii=False)
+
         db.session.commit()
+        # The bulk deletes above bypass the maintained counters
+        reconcile_story_stats()
         print("✅ 初始数据创建成功！")
         print(f"📊 创建了3个故事，9个证据项")
 
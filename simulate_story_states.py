@@ -0,0 +1,195 @@
+"""
+故事状态机快进模拟器 - 用虚拟时钟和合成评论驱动 STORY_STATES，离线评估各状态占用、证据生成量和调度负载
+
+用法:
+    python simulate_story_states.py --stories 5000 --days 7 --comment-rate 0.2
+"""
+import argparse
+import math
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import mock
+
+
+def poisson(rng, lam):
+    """Poisson sample (Knuth for small lambda, normal approximation otherwise)"""
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, int(round(rng.gauss(lam, math.sqrt(lam)))))
+    limit, k, p = math.exp(-lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_simulation(stories=1000, days=7, tick_minutes=30, comment_rate=0.2, spread_hours=24, seed=42):
+    """
+    Drive initialize_story_state / check_state_transition / transition_story_state
+    against an in-memory database with a virtual clock. Story creation is spread
+    evenly over the first spread_hours. Returns a report dict.
+    """
+    import story_engine
+    from app import create_app
+
+    # A dedicated app, so a process that already has the real app never touches its database
+    sim_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    random.seed(seed)  # transition_story_state picks branches with the global RNG
+
+    clock = {'now': datetime(2025, 1, 1)}
+    media_jobs = Counter()
+    story_engine.set_clock(lambda: clock['now'])
+    try:
+        # Count evidence jobs instead of rendering them, and keep simulated deadlines away from
+        # a transition timer this process may be running
+        with mock.patch.object(story_engine, 'enqueue_state_evidence',
+                               lambda story_id, state, media_types: media_jobs.update(media_types)), \
+                mock.patch.object(story_engine, 'schedule_transition', lambda story, due_at: None):
+            report = _simulate(sim_app, media_jobs, clock, stories, days, tick_minutes, comment_rate,
+                               spread_hours, seed)
+    finally:
+        story_engine.set_clock(None)
+    return report
+
+
+def _simulate(app, media_jobs, clock, stories, days, tick_minutes, comment_rate, spread_hours, seed):
+    from app import db, Story
+    from story_engine import (STORY_STATES, INTERACTION_THRESHOLD, initialize_story_state,
+                              check_state_transition, transition_story_state, record_user_interaction)
+
+    rng = random.Random(seed)
+    tick = timedelta(minutes=tick_minutes)
+    tick_hours = tick_minutes / 60.0
+    total_ticks = int(days * 24 * 60 / tick_minutes)
+    occupancy = Counter()
+    work_per_tick = []
+    comments = 0
+    started = time.monotonic()
+
+    start = clock['now']
+    arrivals = [start + timedelta(hours=spread_hours * i / stories) for i in range(stories)]
+    created = 0
+
+    with app.app_context():
+        db.create_all()
+        db.session().expire_on_commit = False
+        by_id = {}
+
+        for _ in range(total_ticks):
+            clock['now'] += tick
+
+            # New stories, as the generation job would post them
+            while created < stories and arrivals[created] <= clock['now']:
+                story = Story(title=f'sim-{created}', content='', location='sim', ai_persona='sim')
+                db.session.add(story)
+                db.session.flush()
+                initialize_story_state(story)
+                by_id[story.id] = story
+                created += 1
+            db.session.commit()
+
+            # Synthetic comment arrivals on stories that are still running
+            for story in by_id.values():
+                if story.current_state == 'ended':
+                    continue
+                for _ in range(poisson(rng, comment_rate * tick_hours)):
+                    record_user_interaction(story)
+                    comments += 1
+            db.session.commit()
+
+            # Work the scheduler would do this tick: the due stories only
+            due_ids = [row.id for row in db.session.query(Story.id).filter(
+                Story.current_state != 'ended',
+                db.or_(
+                    Story.next_transition_at.is_(None),
+                    Story.next_transition_at <= clock['now'],
+                    Story.interaction_count >= INTERACTION_THRESHOLD
+                )
+            )]
+            work_per_tick.append(len(due_ids))
+            for story_id in due_ids:
+                story = by_id[story_id]
+                if check_state_transition(story):
+                    transition_story_state(story)
+            db.session.commit()
+
+            occupancy.update(story.current_state for story in by_id.values())
+
+        text_updates = sum(story.evidence_generated or 0 for story in by_id.values())
+        final_states = Counter(story.current_state for story in by_id.values())
+
+    simulated_hours = total_ticks * tick_hours
+    return {
+        'stories': created,
+        'simulated_hours': simulated_hours,
+        'wall_seconds': round(time.monotonic() - started, 2),
+        'comments': comments,
+        'mean_occupancy': {state: round(occupancy[state] / total_ticks, 1)
+                           for state in STORY_STATES if occupancy[state]},
+        'final_states': dict(final_states),
+        'evidence': {
+            'text': text_updates,
+            'image_jobs': media_jobs['image'],
+            'audio_jobs': media_jobs['audio'],
+            'per_hour': round((text_updates + sum(media_jobs.values())) / simulated_hours, 2)
+        },
+        'scheduler_work_per_tick': {
+            'mean': round(sum(work_per_tick) / len(work_per_tick), 2),
+            'p95': percentile(work_per_tick, 95),
+            'max': max(work_per_tick),
+            'idle_ticks': work_per_tick.count(0)
+        }
+    }
+
+
+def print_report(report):
+    print(f"📊 {report['stories']} 个故事，模拟 {report['simulated_hours']:.0f} 小时，"
+          f"耗时 {report['wall_seconds']}s，共 {report['comments']} 条评论")
+    print("\n状态平均占用:")
+    for state, count in report['mean_occupancy'].items():
+        print(f"  {state:<18}{count:>10}")
+    print("\n最终状态:")
+    for state, count in sorted(report['final_states'].items(), key=lambda item: -item[1]):
+        print(f"  {state:<18}{count:>10}")
+    evidence = report['evidence']
+    print(f"\n证据: 文字 {evidence['text']}，图片任务 {evidence['image_jobs']}，"
+          f"音频任务 {evidence['audio_jobs']}（{evidence['per_hour']} 个/小时）")
+    work = report['scheduler_work_per_tick']
+    print(f"调度负载(每 tick 到期故事数): mean={work['mean']} p95={work['p95']} "
+          f"max={work['max']} idle_ticks={work['idle_ticks']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fast-forward simulation of the story state machine')
+    parser.add_argument('--stories', type=int, default=1000)
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--tick-minutes', type=int, default=30)
+    parser.add_argument('--comment-rate', type=float, default=0.2, help='comments per story per hour')
+    parser.add_argument('--spread-hours', type=float, default=24, help='spread story creation over this many hours')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    print_report(run_simulation(
+        stories=args.stories,
+        days=args.days,
+        tick_minutes=args.tick_minutes,
+        comment_rate=args.comment_rate,
+        spread_hours=args.spread_hours,
+        seed=args.seed
+    ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+静态文件缓存层 - Cache-Control、基于内容的强 ETag、预压缩的 .br/.gz 文本资源、Range 请求，以及条件请求命中率统计
+
+预压缩:
+    python static_cache.py static
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+import threading
+
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_RESPONSES = metrics.counter('static_responses_total', 'Static file responses by area and status code')
+STATIC_BYTES = metrics.counter('static_bytes_sent_total', 'Static file body bytes sent by area')
+
+# Content-addressed files never change under the same name
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# HTML must be revalidated so new deployments show up; the ETag makes that a 304
+REVALIDATE = 'no-cache'
+ASSET_MAX_AGE = int(os.getenv('STATIC_MAX_AGE_SECONDS', 3600))
+
+# Text assets that may have pre-compressed siblings, and the sibling suffixes in preference order
+COMPRESSIBLE = {'.html', '.css', '.js', '.mjs', '.json', '.svg', '.txt', '.xml', '.map'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+MIN_COMPRESS_BYTES = 1024
+
+_etag_cache = {}  # path -> ((mtime_ns, size), etag)
+_etag_lock = threading.Lock()
+ETAG_CACHE_SIZE = 10000
+
+
+def _content_etag(path, stat):
+    """md5 of the file contents, recomputed only when mtime or size change"""
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _etag_lock:
+        cached = _etag_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+
+    with _etag_lock:
+        if len(_etag_cache) >= ETAG_CACHE_SIZE:
+            _etag_cache.clear()
+        _etag_cache[path] = (key, etag)
+    return etag
+
+
+def default_cache_control(filename):
+    if filename.endswith('.html'):
+        return REVALIDATE
+    return f'public, max-age={ASSET_MAX_AGE}'
+
+
+def send_static(directory, filename, area='app', cache_control=None):
+    """
+    Serve directory/filename (relative to the app root) with a strong content ETag, Cache-Control,
+    a pre-compressed sibling when the client accepts it, and If-None-Match / Range handling.
+    """
+    path = safe_join(os.path.join(current_app.root_path, directory), filename)
+    if path is None or not os.path.isfile(path):
+        STATIC_RESPONSES.inc(area=area, status=404)
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    compressible = os.path.splitext(filename)[1].lower() in COMPRESSIBLE
+    encoding = None
+    if compressible:
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, name
+                break
+
+    stat = os.stat(path)
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=_content_etag(path, stat),
+        last_modified=stat.st_mtime
+    )
+    response.headers['Cache-Control'] = cache_control or default_cache_control(filename)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+
+    STATIC_RESPONSES.inc(area=area, status=response.status_code)
+    if response.status_code in (200, 206):
+        STATIC_BYTES.inc(response.content_length or 0, area=area)
+    return response
+
+
+def cache_stats():
+    """Per area: responses, 304s, range responses and the revalidation hit rate"""
+    stats = {}
+    for labels, count in STATIC_RESPONSES.samples():
+        area = stats.setdefault(labels['area'], {'responses': 0, 'not_modified': 0, 'partial': 0})
+        area['responses'] += count
+        if labels['status'] == 304:
+            area['not_modified'] += count
+        elif labels['status'] == 206:
+            area['partial'] += count
+    for labels, sent in STATIC_BYTES.samples():
+        stats.setdefault(labels['area'], {'responses': 0, 'not_modified': 0, 'partial': 0})['bytes_sent'] = sent
+    for area in stats.values():
+        area['hit_rate'] = round(area['not_modified'] / area['responses'], 3) if area['responses'] else 0.0
+    return stats
+
+
+def precompress(directory):
+    """Write .gz (and .br when brotli is installed) next to every compressible file that lacks a fresh one"""
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                continue
+            stat = os.stat(path)
+            if stat.st_size < MIN_COMPRESS_BYTES:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            siblings = [('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                siblings.append(('.br', lambda raw: brotli.compress(raw, quality=11)))
+            for suffix, compress in siblings:
+                target = path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime >= stat.st_mtime:
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compress(data))
+                written += 1
+                print(f"🗜️  {target}")
+    if brotli is None:
+        print("⚠️ brotli 未安装，只生成了 .gz")
+    return written
+
+
+if __name__ == '__main__':
+    count = precompress(sys.argv[1] if len(sys.argv) > 1 else 'static')
+    print(f"✅ 写入 {count} 个预压缩文件")
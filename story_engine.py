@@ -1,6 +1,23 @@
 import json
 from datetime import datetime, timedelta
-from ai_engine import generate_evidence_image, generate_evidence_audio
+from ai_engine import plan_evidence_images, generate_evidence_audio
+from sqlalchemy.orm.attributes import set_committed_value
+from transition_timer import schedule_transition
+from evidence_jobs import enqueue_state_evidence
+
+# Number of user comments that triggers an early transition
+INTERACTION_THRESHOLD = 10
+
+# Clock used for all state-machine timing; the simulator swaps in a virtual clock
+_clock = datetime.utcnow
+
+def utcnow():
+    return _clock()
+
+def set_clock(clock):
+    """Replace the state-machine clock (pass None to restore datetime.utcnow)"""
+    global _clock
+    _clock = clock or datetime.utcnow
 
 # Story state machine
 STORY_STATES = {
@@ -68,25 +85,32 @@ STORY_STATES = {
 
 def initialize_story_state(story):
     """Initialize state machine for a story"""
+    from app import StateTransition
+    
     state_data = {
-        'current_state': 'init',
-        'state_history': [
-            {
-                'state': 'init',
-                'timestamp': datetime.utcnow().isoformat(),
-                'trigger': 'story_created'
-            }
-        ],
-        'next_transition_time': (datetime.utcnow() + timedelta(hours=STORY_STATES['init']['duration_hours'])).isoformat(),
-        'user_interaction_count': 0,
-        'evidence_generated': 0
+        'current_state': 'init'
     }
     
     story.state_data = json.dumps(state_data)
     story.current_state = 'init'
+    story.interaction_count = 0
+    story.evidence_generated = 0
+    story.transitions.append(StateTransition(state='init', trigger='story_created', at=utcnow()))
+    set_next_transition(story, 'init')
     
     return story
 
+def set_next_transition(story, state):
+    """Set next_transition_at for the given state and hand the deadline to the transition timer"""
+    if not STORY_STATES[state]['next_states']:
+        story.next_transition_at = None
+    else:
+        # Ending states have duration 0 and move on to 'ended' right away
+        duration = STORY_STATES[state]['duration_hours']
+        story.next_transition_at = utcnow() + timedelta(hours=duration)
+    
+    schedule_transition(story, story.next_transition_at)
+
 def check_state_transition(story):
     """Check if story should transition to next state"""
     if not story.state_data:
@@ -94,33 +118,40 @@ def check_state_transition(story):
     
     state_data = json.loads(story.state_data)
     
-    # Check if next_transition_time exists
-    if 'next_transition_time' not in state_data:
-        # Initialize state data if missing
-        initialize_story_state(story)
-        return False
+    # Check if next_transition_at exists
+    if story.next_transition_at is None:
+        if state_data.get('current_state') == 'ended':
+            return False
+        legacy_deadline = state_data.get('next_transition_time')
+        if legacy_deadline is None:
+            # Initialize state data if missing
+            initialize_story_state(story)
+            return False
+        # Story from before next_transition_at that the schema upgrade hasn't backfilled: keep its deadline
+        story.next_transition_at = datetime.fromisoformat(legacy_deadline)
+        schedule_transition(story, story.next_transition_at)
     
     # Check if it's time to transition
-    next_transition_time = datetime.fromisoformat(state_data['next_transition_time'])
-    
-    if datetime.utcnow() >= next_transition_time:
+    if utcnow() >= story.next_transition_at:
         return True
     
     # Check if user interaction threshold is met (can trigger early transition)
-    if state_data.get('user_interaction_count', 0) >= 10:
+    if (story.interaction_count or 0) >= INTERACTION_THRESHOLD:
         return True
     
     return False
 
-def transition_story_state(story, app_context):
-    """Transition story to next state"""
-    from app import db, Evidence
-    from ai_engine import generate_ai_story, generate_evidence_image, generate_evidence_audio
+def transition_story_state(story):
+    """
+    Transition story to next state. Returns False if the story has ended or another worker
+    (timer, due poll, sweep) already moved it out of the state it was loaded in.
+    """
+    from app import db, StateTransition, Story
     
     if not story.state_data:
         initialize_story_state(story)
         db.session.commit()
-        return
+        return True
     
     state_data = json.loads(story.state_data)
     current_state = state_data['current_state']
@@ -129,12 +160,12 @@ def transition_story_state(story, app_context):
     possible_next_states = STORY_STATES[current_state]['next_states']
     
     if not possible_next_states:
-        return  # Story has ended
+        return False  # Story has ended
     
     # Choose next state based on user interaction
     # More interactions = more investigation/revelation path
     # Fewer interactions = more escalation/danger path
-    interaction_ratio = state_data['user_interaction_count'] / 10.0
+    interaction_ratio = (story.interaction_count or 0) / float(INTERACTION_THRESHOLD)
     
     if interaction_ratio > 0.7 and 'investigation' in possible_next_states:
         next_state = 'investigation'
@@ -149,111 +180,158 @@ def transition_story_state(story, app_context):
         import random
         next_state = random.choice(possible_next_states)
     
+    # Compare-and-set on the state this story was read in: the row lock taken here makes a
+    # concurrent transition of the same story wait, then match no row once this one commits
+    claimed = db.session.execute(
+        db.update(Story)
+        .where(Story.id == story.id, Story.current_state == story.current_state)
+        .values(current_state=next_state)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return False
+    
     # Update state
     state_data['current_state'] = next_state
-    state_data['state_history'].append({
-        'state': next_state,
-        'timestamp': datetime.utcnow().isoformat(),
-        'trigger': 'time_based' if datetime.utcnow() >= datetime.fromisoformat(state_data['next_transition_time']) else 'interaction_based'
-    })
-    
-    # Set next transition time
-    duration = STORY_STATES[next_state]['duration_hours']
-    if duration > 0:
-        state_data['next_transition_time'] = (datetime.utcnow() + timedelta(hours=duration)).isoformat()
-    
-    # Reset interaction counter
-    state_data['user_interaction_count'] = 0
+    now = utcnow()
+    trigger = 'interaction_based' if (story.interaction_count or 0) >= INTERACTION_THRESHOLD else 'time_based'
+    story.transitions.append(StateTransition(state=next_state, trigger=trigger, at=now))
     
     story.state_data = json.dumps(state_data)
     story.current_state = next_state
     
-    # Generate new evidence based on state
-    with app_context():
-        generate_state_evidence(story, next_state)
+    # Reset interaction counter and any failed attempts
+    story.interaction_count = 0
+    story.transition_failures = 0
+    story.transition_error = None
+    
+    # Set next transition time
+    set_next_transition(story, next_state)
     
+    # Phase 1: commit the state change together with the cheap text update
+    media_types = generate_state_evidence(story, next_state)
     db.session.commit()
+    
+    # Phase 2: images/audio are rendered by the evidence workers, outside this transaction
+    if media_types:
+        enqueue_state_evidence(story.id, next_state, media_types)
+    return True
+
+# Evidence generated on entering each state
+STATE_EVIDENCE_TYPES = {
+    'init': ['text'],
+    'unfolding': ['image', 'text'],
+    'investigation': ['image', 'audio'],
+    'escalation': ['image', 'audio', 'text'],
+    'danger': ['image', 'audio'],
+    'revelation': ['text', 'image'],
+    'twist': ['image', 'audio'],
+    'climax': ['image', 'audio', 'text']
+}
 
 def generate_state_evidence(story, state):
-    """Generate appropriate evidence for current state"""
-    from app import db, Evidence, Comment
-    
-    # Generate evidence based on state
-    evidence_types = {
-        'init': ['text'],
-        'unfolding': ['image', 'text'],
-        'investigation': ['image', 'audio'],
-        'escalation': ['image', 'audio', 'text'],
-        'danger': ['image', 'audio'],
-        'revelation': ['text', 'image'],
-        'twist': ['image', 'audio'],
-        'climax': ['image', 'audio', 'text']
-    }
+    """Add the text update for the current state, returns the media types still to be rendered"""
+    from app import db, Comment, Story
+    
+    types_to_generate = STATE_EVIDENCE_TYPES.get(state, ['text'])
+    
+    if 'text' in types_to_generate:
+        # Generate text update via AI
+        update_texts = {
+            'init': f'【更新】{story.ai_persona}首次发布了这个故事...',
+            'unfolding': f'【更新】事态正在发展，{story.location}出现了新的情况...',
+            'investigation': f'【更新】经过调查，我发现了一些令人不安的细节...',
+            'escalation': f'【更新】情况比我想象的要严重，它又出现了...',
+            'danger': f'【更新】我可能惹上麻烦了，有人在跟踪我...',
+            'revelation': f'【更新】真相终于浮出水面，但我宁愿自己从未知道...',
+            'twist': f'【更新】等等，事情根本不是我想的那样...',
+            'climax': f'【最终更新】这是我最后一次发帖了...'
+        }
+        
+        update_text = update_texts.get(state, '【更新】情况有了新的进展...')
+        
+        comment = Comment(
+            content=update_text,
+            story_id=story.id,
+            author_id=None,
+            is_ai_response=True
+        )
+        db.session.add(comment)
+        story.evidence_generated = Story.evidence_generated + 1
     
-    types_to_generate = evidence_types.get(state, ['text'])
+    return [t for t in types_to_generate if t in ('image', 'audio')]
+
+def generate_state_media(story_id, state, media_types):
+    """Render image/audio evidence for a state change and attach it (runs on an evidence worker)"""
+    from app import db, Evidence, Story
+    
+    story = Story.query.get(story_id)
+    if not story:
+        return 0
+    title, content, category = story.title, story.content, story.category
+    location, ai_persona = story.location, story.ai_persona
+    # End the read transaction before the slow rendering work
+    db.session.rollback()
     
-    for evidence_type in types_to_generate:
+    evidence_items = []
+    for evidence_type in media_types:
         if evidence_type == 'image':
-            image_path = generate_evidence_image(story.title, story.content)
-            if image_path:
-                evidence = Evidence(
-                    story_id=story.id,
+            for image in plan_evidence_images(title, content, category, variant=state):
+                evidence_items.append(Evidence(
+                    story_id=story_id,
                     evidence_type='image',
-                    file_path=image_path,
-                    description=f'在{story.location}发现的可疑照片'
-                )
-                db.session.add(evidence)
+                    file_path=image['file_path'],
+                    render_recipe=image['render_recipe'],
+                    description=f'在{location}发现的可疑照片'
+                ))
         
         elif evidence_type == 'audio':
-            audio_path = generate_evidence_audio(story.content)
+            audio_path = generate_evidence_audio(content)
             if audio_path:
-                evidence = Evidence(
-                    story_id=story.id,
+                evidence_items.append(Evidence(
+                    story_id=story_id,
                     evidence_type='audio',
                     file_path=audio_path,
-                    description=f'{story.ai_persona}的录音记录'
-                )
-                db.session.add(evidence)
-        
-        elif evidence_type == 'text':
-            # Generate text update via AI
-            update_texts = {
-                'init': f'【更新】{story.ai_persona}首次发布了这个故事...',
-                'unfolding': f'【更新】事态正在发展，{story.location}出现了新的情况...',
-                'investigation': f'【更新】经过调查，我发现了一些令人不安的细节...',
-                'escalation': f'【更新】情况比我想象的要严重，它又出现了...',
-                'danger': f'【更新】我可能惹上麻烦了，有人在跟踪我...',
-                'revelation': f'【更新】真相终于浮出水面，但我宁愿自己从未知道...',
-                'twist': f'【更新】等等，事情根本不是我想的那样...',
-                'climax': f'【最终更新】这是我最后一次发帖了...'
-            }
-            
-            update_text = update_texts.get(state, '【更新】情况有了新的进展...')
-            
-            comment = Comment(
-                content=update_text,
-                story_id=story.id,
-                author_id=None,
-                is_ai_response=True
-            )
-            db.session.add(comment)
-    
-    # Update evidence count
-    if story.state_data:
-        state_data = json.loads(story.state_data)
-        state_data['evidence_generated'] += len(types_to_generate)
-        story.state_data = json.dumps(state_data)
+                    description=f'{ai_persona}的录音记录'
+                ))
+    
+    if not evidence_items:
+        return 0
+    
+    # Short write transaction: attach the rendered files and bump the counter atomically
+    db.session.add_all(evidence_items)
+    db.session.execute(
+        db.update(Story)
+        .where(Story.id == story_id)
+        .values(evidence_generated=Story.evidence_generated + len(evidence_items))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return len(evidence_items)
 
 def record_user_interaction(story):
-    """Record user interaction with story"""
+    """Record user interaction with story, returns the new interaction count"""
+    from app import db, Story
+    
     if not story.state_data:
         initialize_story_state(story)
+        db.session.flush()
     
-    state_data = json.loads(story.state_data)
+    # Single atomic increment, so concurrent comments can't overwrite each other
+    count = db.session.execute(
+        db.update(Story)
+        .where(Story.id == story.id)
+        .values(interaction_count=Story.interaction_count + 1)
+        .returning(Story.interaction_count)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    set_committed_value(story, 'interaction_count', count)
     
-    # 确保 user_interaction_count 存在
-    if 'user_interaction_count' not in state_data:
-        state_data['user_interaction_count'] = 0
+    # Crossing the threshold makes the story due now; the deadline is stored as well so
+    # the scheduler leader picks it up even when this comment arrives on another worker
+    if count == INTERACTION_THRESHOLD:
+        story.next_transition_at = utcnow()
+        schedule_transition(story, story.next_transition_at)
     
-    state_data['user_interaction_count'] += 1
-    story.state_data = json.dumps(state_data)
+    return count
@@ -0,0 +1,126 @@
+"""
+故事统计计数 - 活跃故事数和各状态故事数保存在 story_stat 表中，随故事写入在同一事务内更新
+"""
+from sqlalchemy import event, inspect
+
+ACTIVE_STORIES = 'active_stories'
+
+
+def state_stat(state):
+    return f'state:{state}'
+
+
+def _bump(connection, deltas):
+    """Apply {stat name: delta} on the flush connection, inside the caller's transaction"""
+    from app import StoryStat
+
+    table = StoryStat.__table__
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        result = connection.execute(
+            table.update().where(table.c.name == name).values(value=table.c.value + delta)
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(name=name, value=delta))
+
+
+def _story_deltas(state, sign):
+    deltas = {state_stat(state): sign}
+    if state != 'ended':
+        deltas[ACTIVE_STORIES] = sign
+    return deltas
+
+
+def _after_insert(mapper, connection, story):
+    _bump(connection, _story_deltas(story.current_state, 1))
+
+
+def _after_update(mapper, connection, story):
+    # Story.current_state has active_history, so the old value is here even if it was expired
+    history = inspect(story).attrs.current_state.history
+    if not history.has_changes() or not history.deleted:
+        return
+    old_state, new_state = history.deleted[0], story.current_state
+    if old_state == new_state:
+        return
+    deltas = _story_deltas(old_state, -1)
+    for name, delta in _story_deltas(new_state, 1).items():
+        deltas[name] = deltas.get(name, 0) + delta
+    _bump(connection, deltas)
+
+
+def _after_delete(mapper, connection, story):
+    _bump(connection, _story_deltas(story.current_state, -1))
+
+
+def register_listeners(story_model):
+    """
+    Keep the counters in step with every ORM insert/update/delete of a story
+    (story_model.current_state must be mapped with active_history=True)
+    """
+    event.listen(story_model, 'after_insert', _after_insert)
+    event.listen(story_model, 'after_update', _after_update)
+    event.listen(story_model, 'after_delete', _after_delete)
+
+
+def _count_stats():
+    """{stat name: value} counted from the story table"""
+    from app import db, Story
+    from story_engine import STORY_STATES
+
+    counts = {state: 0 for state in STORY_STATES}
+    for state, count in db.session.query(Story.current_state, db.func.count(Story.id)).group_by(Story.current_state):
+        counts[state] = count
+
+    values = {state_stat(state): count for state, count in counts.items()}
+    values[ACTIVE_STORIES] = sum(count for state, count in counts.items() if state != 'ended')
+    return values
+
+
+def reconcile_story_stats():
+    """
+    Recompute all counters from the story table (fixes drift from bulk deletes or raw SQL), in one
+    transaction. The counter rows are locked before counting, so an increment from a concurrent
+    story write either committed before the count (and is included in it) or waits and applies on
+    top of the new value. SQLite ignores FOR UPDATE, but its single writer lock makes a conflicting
+    reconcile fail instead of overwriting.
+    """
+    from app import db, StoryStat
+
+    existing = {stat.name: stat for stat in StoryStat.query.with_for_update().all()}
+    values = _count_stats()
+    for name in existing:
+        values.setdefault(name, 0)  # states that no longer have any stories
+    for name, value in values.items():
+        if name in existing:
+            existing[name].value = value
+        else:
+            db.session.add(StoryStat(name=name, value=value))
+    db.session.commit()
+    return values
+
+
+def get_stat(name):
+    """Read-only: a counter that isn't maintained yet is counted directly (the reconcile job stores it)"""
+    from app import db, StoryStat
+
+    stat = db.session.get(StoryStat, name)
+    if stat is None:
+        return _count_stats().get(name, 0)
+    return stat.value
+
+
+def active_story_count():
+    return get_stat(ACTIVE_STORIES)
+
+
+def state_counts():
+    """{state: count} for dashboards"""
+    from app import StoryStat
+
+    prefix = state_stat('')
+    return {
+        stat.name[len(prefix):]: stat.value
+        for stat in StoryStat.query.filter(StoryStat.name.startswith(prefix))
+    }
@@ -0,0 +1,164 @@
+"""
+故事状态转换定时器 - 在下一个 next_transition_at 到期时精确唤醒，取代固定间隔的全表扫描
+"""
+import heapq
+import threading
+from datetime import datetime
+from sqlalchemy import inspect
+
+_timer = None
+
+
+class TransitionTimer:
+    """Min-heap of (due_at, story_id) served by a single thread that sleeps until the earliest deadline"""
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._heap = []
+        self._deadlines = {}  # story_id -> latest due_at; older heap entries are skipped lazily
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def schedule(self, story_id, due_at):
+        """Set (or replace) the deadline for a story"""
+        with self._cond:
+            self._deadlines[story_id] = due_at
+            heapq.heappush(self._heap, (due_at, story_id))
+            # Only wake the thread if the new entry is now the earliest one
+            if self._heap[0] == (due_at, story_id):
+                self._cond.notify()
+
+    def cancel(self, story_id):
+        with self._cond:
+            self._deadlines.pop(story_id, None)
+
+    def load(self, entries):
+        """Bulk-load (story_id, due_at) pairs, e.g. from the database at startup"""
+        with self._cond:
+            for story_id, due_at in entries:
+                self._deadlines[story_id] = due_at
+                self._heap.append((due_at, story_id))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def deadline(self, story_id):
+        with self._cond:
+            return self._deadlines.get(story_id)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def next_due(self):
+        with self._cond:
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='transition-timer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _next_story(self):
+        """Block until a deadline is due; returns the story id, or None when stopped"""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due_at, story_id = self._heap[0]
+                delay = (due_at - datetime.utcnow()).total_seconds()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._heap)
+                if self._deadlines.get(story_id) != due_at:
+                    continue  # superseded or cancelled
+                del self._deadlines[story_id]
+                return story_id
+            return None
+
+    def _run(self):
+        while True:
+            story_id = self._next_story()
+            if story_id is None:
+                return
+            try:
+                self._callback(story_id)
+            except Exception as e:
+                print(f"⚠️ 状态转换失败 story_id={story_id}: {e}")
+
+
+def get_timer():
+    return _timer
+
+
+def schedule_transition(story, due_at):
+    """Queue a story's next deadline; it reaches the timer once the surrounding session commits"""
+    if _timer is None:
+        return
+    from app import db
+    db.session.info.setdefault('pending_transitions', []).append((story, due_at))
+
+
+def _push_pending(session):
+    pending = session.info.pop('pending_transitions', None)
+    if not pending or _timer is None:
+        return
+    for story, due_at in pending:
+        # The session can't emit SQL here, so read the primary key from the identity map
+        identity = inspect(story).identity
+        if not identity:
+            continue
+        if due_at is None:
+            _timer.cancel(identity[0])
+        else:
+            _timer.schedule(identity[0], due_at)
+
+
+def _drop_pending(session):
+    session.info.pop('pending_transitions', None)
+
+
+def start_transition_timer(app, callback):
+    """Create the process-wide timer, load all pending deadlines from the DB and start it"""
+    global _timer
+    from sqlalchemy import event
+    from app import db, Story
+
+    if _timer is not None:
+        return _timer
+
+    timer = TransitionTimer(callback)
+    with app.app_context():
+        if not event.contains(db.session, 'after_commit', _push_pending):
+            event.listen(db.session, 'after_commit', _push_pending)
+            event.listen(db.session, 'after_rollback', _drop_pending)
+        rows = db.session.query(Story.id, Story.next_transition_at).filter(
+            Story.current_state != 'ended',
+            Story.next_transition_at.isnot(None)
+        ).all()
+        timer.load(rows)
+
+    _timer = timer
+    timer.start()
+    print(f"✅ Transition timer started with {len(timer)} pending stories")
+    return timer
+
+
+def stop_transition_timer():
+    global _timer
+    timer, _timer = _timer, None
+    if timer is not None:
+        timer.stop()